@@ -5,3 +5,15 @@ from .generic_models import *
 from .less_generic_models import *
 from .decorators import *
 from .trace_analysis import *
+from syscall2api.tokenizer import *
+from syscall2api.interned import *
+from .columnar import *
+from syscall2api.syscall_index import *
+from syscall2api.kb_store import load_store_syscall_index
+from .binary_trace import *
+from .dedup import *
+from .partitions import *
+from .timeline import *
+from .call_graph import *
+from .kb_filters import *
+from .lazy_kb import *
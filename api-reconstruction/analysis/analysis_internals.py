@@ -7,6 +7,7 @@ import stat
 import os
 import sys
 import random
+import csv
 
 from functools import reduce
 from pathlib import Path
@@ -17,6 +18,11 @@ from interruptingcow import timeout
 from .classes import *
 from .decorators import *
 from .utils import *
+from .columnar import *
+from .dedup import *
+from .call_graph import *
+from .kb_filters import *
+from .lazy_kb import *
 
 ## Declaring global objects
 signal_regex = re.compile(r"--- SIG.* ---")
@@ -26,100 +32,20 @@ noisy_syscalls = ('futex', 'madvise', 'clock_gettime', 'sched_yield')
 
 def all_symbols_for_api(kb, api):
     ret = set()
-    for trace in kb[api]:
+    for trace in kb_realizations(kb, api):
         trace = prune_syscalls_args(trace)
         for t, call in trace:
             ret.add(call)
     return ret
 
-def traverse(d, api, visited=None):
-    if api in traverse.cache:
-        return traverse.cache[api]
-
-    if visited is None:
-        visited = set()
-
-    # Avoid infinite recursion. Fallback to False, this should be safe
-    if api in visited:
-        return False
-
-    visited |= set([api])
-    if api not in d:
-        traverse.cache[api] = False
-        return False
-
-    realizations = d[api]
-    ret = False
-
-    for r in realizations:
-        sys = get_syscall_list_from_trace(r)
-        if len(sys) != 0:
-            visited -= set([api])
-            traverse.cache[api] = True
-            return True
-
-    subapis = set()
-    for r in realizations:
-        subapis |= set(get_api_list_from_trace(r))
-
-    for subapi in subapis:
-        if traverse(d, subapi, visited):
-            visited -= set([api])
-            traverse.cache[api] = True
-            return True
-
-    visited -= set([api])
-    traverse.cache[api] = False
-    return False
-
-def childs_are_weak_polymorph(d, api, visited=None):
-    if api in childs_are_weak_polymorph.cache:
-        return childs_are_weak_polymorph.cache[api]
-
-    if visited is None:
-        visited = set()
-
-    # Avoid infinite recursion. Fallback to False, this should be safe
-    if api in visited:
-        return False
-
-    visited |= set([api])
-    if api not in d:
-        childs_are_weak_polymorph.cache[api] = False
-        return False
-
-    realizations = d[api]
-    ret = False
-
-    subapis = set()
-    for r in realizations:
-        subapis |= set(get_api_list_from_trace(r))
-
-    for subapi in subapis:
-        if is_polymorphic(d, subapi):
-            visited -= set([api])
-            childs_are_weak_polymorph.cache[api] = True
-            return True
-        if is_leaf(d, subapi):
-            continue
-        if childs_are_weak_polymorph(d, subapi, visited):
-            visited -= set([api])
-            childs_are_weak_polymorph.cache[api] = True
-            return True
-
-    visited -= set([api])
-    childs_are_weak_polymorph.cache[api] = False
-    return False
-
+## Whether an API reaches an API that is polymorphic, itself included
 def is_weak_polymorph(d, api):
-    if is_polymorphic(d, api):
-        return True
-    if is_leaf(d, api):
-        return False
-    return childs_are_weak_polymorph(d, api)
+    return api in find_weak_polymorph(d)
 
 def is_leaf(d, api):
-    realizations = d[api]
+    realizations = kb_realizations(d, api)
+    if isinstance(realizations, CSRRealizations):
+        return realizations.api_calls() == 0
     ret = True
     for r in realizations:
         for call in r:
@@ -131,6 +57,8 @@ def is_leaf(d, api):
     return ret
 
 def find_leaves(d):
+    if isinstance(d, CSRKB):
+        return d.select(d.api_calls_per_api() == 0)
     ret = set()
     for api in d:        
         if is_leaf(d, api):
@@ -149,6 +77,8 @@ def realizations_are_equals(r1, r2):
     return True
 
 def is_polymorphic(d, api):
+    if isinstance(d, DedupKB):
+        return len(d.entries(api)) > 1
     realizations = d[api]
     for i in range(len(realizations) - 1):
         if not realizations_are_equals(realizations[i], realizations[i+1]):
@@ -159,7 +89,7 @@ def realization_is_empty(r):
     return len(r) == 0
 
 def is_empty(d, api):
-    realizations = d[api]
+    realizations = kb_realizations(d, api)
     for r in realizations:
         if not realization_is_empty(r):
             return False
@@ -172,14 +102,15 @@ def realization_makes_syscalls(r):
     return False
 
 def makes_syscalls(d, api):
-    realizations = d[api]
+    realizations = kb_realizations(d, api)
     for r in realizations:
         if realization_makes_syscalls(r):
             return True
     return False
 
+## Whether an API reaches an API that makes syscalls, itself included
 def has_indirect_sys(d, api):
-    return traverse(d, api)
+    return api not in find_no_indirect_sys(d)
 
 def find_polymorph(d):
     ret = set()
@@ -188,15 +119,21 @@ def find_polymorph(d):
             ret.add(api)
     return ret
 
-def find_weak_polymorph(d):
-    ret = set()
-    childs_are_weak_polymorph.cache = {}
-    for api in d:
-        if is_weak_polymorph(d, api):
-            ret.add(api)
-    return ret
+def polymorph_flags(d, graph):
+    flags = np.zeros(len(graph), dtype=bool)
+    flags[:graph.kb_size] = [is_polymorphic(d, api)
+                             for api in graph.apis[:graph.kb_size]]
+    return flags
+
+def find_weak_polymorph(d, graph=None):
+    if graph is None:
+        graph = APICallGraph(d)
+    (weak,) = graph.reaches(polymorph_flags(d, graph))
+    return graph.select(weak)
 
 def find_empties(d):
+    if isinstance(d, CSRKB):
+        return d.select(d.events_per_api() == 0)
     ret = set()
     for api in d:
         if is_empty(d, api):
@@ -204,83 +141,124 @@ def find_empties(d):
     return ret
 
 def find_no_syscall_apis(d):
+    if isinstance(d, CSRKB):
+        return d.select(d.syscalls_per_api() == 0)
     ret = set()
     for api in d:
         if not makes_syscalls(d, api):
             ret.add(api)
     return ret
 
-def find_no_indirect_sys(d):
-    ret = set()
-    traverse.cache = {}
-    for api in d:
-        if not has_indirect_sys(d, api):
-            ret.add(api)
-    return ret
-
+def find_no_indirect_sys(d, graph=None):
+    if graph is None:
+        graph = APICallGraph(d)
+    (ind_sys,) = graph.reaches(graph.makes_syscalls)
+    return graph.select(~ind_sys)
+
+
+## Boolean columns of the KB categories, indexed by the API IDs of the
+## call graph: leaf, polymorph, empty, sys (makes syscalls), ind_sys
+## (reaches an API that makes syscalls) and weak_polymorph. They are
+## computed in one pass over the KB, plus one over the call graph.
+def kb_categories(d, graph=None):
+    if graph is None:
+        graph = APICallGraph(d)
+    n = graph.kb_size
+    polymorph = np.zeros(len(graph), dtype=bool)
+    empty = np.zeros(n, dtype=bool)
+    for i, api in enumerate(graph.apis[:n]):
+        polymorph[i] = is_polymorphic(d, api)
+        empty[i] = all(realization_is_empty(r)
+                       for r in kb_realizations(d, api))
+    (ind_sys, weak_polymorph) = graph.reaches(graph.makes_syscalls, polymorph)
+    return {'apis': graph.apis[:n],
+            'leaf': graph.leaves(),
+            'polymorph': polymorph[:n],
+            'empty': empty,
+            'sys': graph.makes_syscalls[:n],
+            'ind_sys': ind_sys[:n],
+            'weak_polymorph': weak_polymorph[:n]}
+
+def category_apis(categories, name):
+    return {categories['apis'][i] for i in np.flatnonzero(categories[name])}
+
+## Categories given as sets of APIs
+def categories_from_sets(apis, leaves, polymorph, no_sys, no_ind_sys):
+    apis = list(apis)
+    col = lambda s: np.array([api in s for api in apis], dtype=bool)
+    return {'apis': apis, 'leaf': col(leaves), 'polymorph': col(polymorph),
+            'sys': ~col(no_sys), 'ind_sys': ~col(no_ind_sys)}
+
+## Table of the number of APIs in each cross of the categories, as
+## [(label, count)]
+def category_measures(categories):
+    leaf = categories['leaf']
+    poly = categories['polymorph']
+    sys = categories['sys']
+    ind_sys = categories['ind_sys']
+    apis = ((leaf, '0API'), (~leaf, '1+API'))
+    morph = ((poly, 'Polymorph'), (~poly, 'No-Polymorph'))
+    table = []
+    for (sys_col, sys_label) in ((sys, 'Sys'), (ind_sys, 'Ind_Sys')):
+        for (a, a_label) in apis:
+            for (s, s_label) in ((~sys_col, '0'), (sys_col, '1+')):
+                for (m, m_label) in morph:
+                    table.append(('%s%s/%s/%s' % (s_label, sys_label,
+                                                  a_label, m_label),
+                                  int(np.count_nonzero(s & a & m))))
+    for (m, m_label) in morph:
+        table.append(('0Sys/1+IndSys/%s' % m_label,
+                      int(np.count_nonzero(~sys & ind_sys & m))))
+    return table
+
+def print_measures(table):
+    for (label, count) in table:
+        print("%s: %d" % (label, count))
+
+def save_measures(table, path='kb_measures.csv'):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('category', 'apis'))
+        writer.writerows(table)
 
 def measures(leaves, polymorph, no_sys, no_ind_sys,
               no_leaves, monomorph, sys, ind_sys):
-    print("0Sys/0API/Polymorph: " + str(len(no_sys & leaves & polymorph)))
-    print("0Sys/0API/No-Polymorph: " + str(len(no_sys & leaves & monomorph)))
-    print("1+Sys/0API/Polymorph: " + str(len(sys & leaves & polymorph)))
-    print("1+Sys/0API/No-Polymorph: " + str(len(sys & leaves & monomorph)))
-
-    print("0Sys/1+API/Polymorph: " + str(len(no_sys & no_leaves & polymorph)))
-    print("0Sys/1+API/No-Polymorph: " +
-          str(len(no_sys & no_leaves & monomorph)))
-    print("1+Sys/1+API/Polymorph: " + str(len(sys & no_leaves & polymorph)))
-    print("1+Sys/1+API/No-Polymorph: " + str(len(sys & no_leaves & monomorph)))
-
-
-    print("0Ind_Sys/0API/Polymorph: " +
-          str(len(no_ind_sys & leaves & polymorph)))
-    print("0Ind_Sys/0API/No-Polymorph: " +
-          str(len(no_ind_sys & leaves & monomorph)))
-    print("1+Ind_Sys/0API/Polymorph: " +
-          str(len(ind_sys & leaves & polymorph)))
-    print("1+Ind_Sys/0API/No-Polymorph: " +
-          str(len(ind_sys & leaves & monomorph)))
-
-    print("0Ind_Sys/1+API/Polymorph: " +
-          str(len(no_ind_sys & no_leaves & polymorph)))
-    print("0Ind_Sys/1+API/No-Polymorph: " +
-          str(len(no_ind_sys & no_leaves & monomorph)))
-    print("1+Ind_Sys/1+API/Polymorph: " +
-          str(len(ind_sys & no_leaves & polymorph)))
-    print("1+Ind_Sys/1+API/No-Polymorph: " +
-          str(len(ind_sys & no_leaves & monomorph)))
-
-
-    print("0Sys/1+IndSys/Polymorph: " +
-          str(len(no_sys & ind_sys & polymorph)))
-    print("0Sys/1+IndSys/No-Polymorph: " +
-          str(len(no_sys & ind_sys & monomorph)))
-
-def build_precise_model_for_api(d, api, strong_monomorph):
-    if api in build_precise_model_for_api.cache:
-        return build_precise_model_for_api.cache[api]
-
-    model = []
-    realization = d[api][0]
-    for call in realization:
-        if call[0] == 'SYS':
-            if (get_syscall_name(call[1]) not in ("futex", "madvise")
-                and not call[1].startswith("--- SIGCHLD")):
-                model.append(call)
-            continue
-        assert call[1] in strong_monomorph, (
-            "%s supposed to be strong monomorph, but it's not" % call[1])
-        model += build_precise_model_for_api(d, call[1], strong_monomorph)
-    build_precise_model_for_api.cache[api] = model
-    return model
-
-def build_precise_models(d, strong_monomorph):
-    build_precise_model_for_api.cache = {}
+    print_measures(category_measures(
+        categories_from_sets(leaves | no_leaves, leaves, polymorph, no_sys,
+                             no_ind_sys)))
+
+def model_keeps_syscall(call):
+    return (get_syscall_name(call[1]) not in ("futex", "madvise")
+            and not call[1].startswith("--- SIGCHLD"))
+
+## Model of each strong monomorph API: the syscalls of its first
+## realization, with the models of the APIs it calls inlined. The APIs are
+## visited after the ones they call. APIs that reach a cycle have no
+## precise model.
+def build_precise_models(d, strong_monomorph, graph=None):
+    if graph is None:
+        graph = APICallGraph(d)
     models = {}
-    for api in strong_monomorph:
-        models[api] = build_precise_model_for_api(d, api, strong_monomorph)
-    return models
+    for c, members in enumerate(graph.components):
+        if graph.cyclic[c]:
+            continue
+        api = graph.apis[members[0]]
+        if api not in strong_monomorph or not graph.in_kb(members[0]):
+            continue
+        model = []
+        for call in kb_realizations(d, api)[0]:
+            if call[0] == 'SYS':
+                if model_keeps_syscall(call):
+                    model.append(call)
+                continue
+            assert call[1] in strong_monomorph, (
+                "%s supposed to be strong monomorph, but it's not" % call[1])
+            if call[1] not in models:
+                break
+            model += models[call[1]]
+        else:
+            models[api] = model
+    return {api: models[api] for api in strong_monomorph if api in models}
 
 def prune_malloc_syscalls(trace, entry_offset=0):
     if not hasattr(prune_malloc_syscalls, "mmap_regex"):
@@ -321,72 +299,64 @@ def prune_malloc_syscalls(trace, entry_offset=0):
         ret.append(call)
     return ret
 
-## Recursively try to build precise model for an API and its sub-API
-def try_build_precise_model_for_api(d, api, models, visited=None):
-    if api in try_build_precise_model_for_api.cache:
-        return try_build_precise_model_for_api.cache[api]
-
-    if visited is None:
-        visited = set()
-
-    # Avoid infinite recursion. Fallback to False, this should be safe
-    if api in visited:
-        raise Exception()
-
-    visited.add(api)
-
-    if api in models:
-        try_build_precise_model_for_api.cache[api] = models[api]
-        visited -= set([api])
-        return models[api]
-
+def remove_noisy_syscalls(trace):
+    return [call for call in trace if call[0] != 'SYS'
+            or get_syscall_name(call[1]) not in noisy_syscalls]
+
+def remove_signal_lines(trace):
+    return [call for call in trace if not signal_regex.match(call[1])]
+
+## Model of an API whose realizations all give the same model once the
+## models of the APIs they call are inlined. A realization is skipped if it
+## calls an API that isn't in the KB, or that belongs to the same cycle as
+## the API. The API has no model if it calls an API without one.
+def try_build_precise_model_for_api(d, graph, v, models, built):
+    api = graph.apis[v]
+    cycle = set(graph.components[graph.comp[v]]) \
+        if graph.cyclic[graph.comp[v]] else set()
     possible_models = []
-    for realization in d[api]:
-        try:
-            pm = []
-            for call in realization:
-                if call[0] == 'SYS':
-                    if (get_syscall_name(call[1]) not in ("futex", "madvise")
-                        and not call[1].startswith('--- SIGCHLD')):
-                        pm.append(call)
-                        continue
-                if call[1] in models:
-                    pm += models[call[1]]
-                    continue
-                ## Try to build the model for the sub-API
-                subapi_model = try_build_precise_model_for_api(d, call[1],
-                                                           models, visited)
-                if subapi_model is not None:
-                    pm += subapi_model
-                else:
-                    visited -= set([api])
-                    try_build_precise_model_for_api.cache[api] = None
-                    return None
-        except Exception:
-            continue
-        possible_models.append(pm)
+    for realization in kb_realizations(d, api):
+        pm = []
+        for call in realization:
+            if call[0] == 'SYS' and model_keeps_syscall(call):
+                pm.append(call)
+                continue
+            if call[1] in models:
+                pm += models[call[1]]
+                continue
+            sub = graph.ids.get(call[1])
+            if sub is None or not graph.in_kb(sub) or sub in cycle:
+                break
+            if built.get(call[1]) is None:
+                return None
+            pm += built[call[1]]
+        else:
+            possible_models.append(pm)
 
-    ret = None
     if len(possible_models) == 0:
-        return ret
+        return None
     for i in range(len(possible_models) - 1):
         if not realizations_are_equals(possible_models[i],
                                        possible_models[i+1]):
-            break
-    else:
-        ret = possible_models[0]
-
-    visited -= set([api])
-    try_build_precise_model_for_api.cache[api] = ret
-    return ret
-
-def find_implicit_monomorph_models(d, models):
+            return None
+    return possible_models[0]
+
+def find_implicit_monomorph_models(d, models, graph=None):
+    if graph is None:
+        graph = APICallGraph(d)
+    built = {}
+    for members in graph.components:
+        for v in members:
+            api = graph.apis[v]
+            if api in models:
+                built[api] = models[api]
+            elif graph.in_kb(v):
+                built[api] = try_build_precise_model_for_api(d, graph, v,
+                                                             models, built)
     ret = dict(models)
-    try_build_precise_model_for_api.cache = {}
     for api in d:
-        m = try_build_precise_model_for_api(d, api, models)
-        if m is not None:
-            ret[api] = m
+        if built.get(api) is not None:
+            ret[api] = built[api]
     return ret
 
 def check_0sys(no_sys, no_ind_sys):
@@ -663,6 +633,8 @@ def make_regex_conditional(regex):
     return [(entry[0], entry[1] | RegexFlags.OPTIONAL) for entry in regex]
 
 def total_trace_length(traces):
+    if isinstance(traces, CSRRealizations):
+        return traces.total_length()
     return sum([len(x) for x in traces])
 
 def avg_trace_length(traces):
@@ -702,7 +674,7 @@ def regex_from_trace(trace):
     return ret
 
 def regex_for_api(kb, api):
-    traces = [t for t in kb[api] if len(t) != 0]
+    traces = [t for t in kb_realizations(kb, api) if len(t) != 0]
 
     if len(traces) == 1:
         return (regex_from_trace(traces[0]), 0, 0, 0)
@@ -728,24 +700,26 @@ def regex_for_api(kb, api):
     (success, tout, fails) = check_traces_match(reg_obj, traces,
                                                 '%s TRAIN' % api)
     print(("### TRAIN Api: %s. %d traces. Matches/Timeouts/Fails %d/%d/%d" +
-          " test traces") % (api, len(kb[api]), success, tout, fails))
+          " test traces") % (api, len(kb_realizations(kb, api)), success,
+                             tout, fails))
     assert fails == 0, ("Regex for api %s failed to cover all" +
                         " the traces in the training set")
 
     (success, tout, fails) = check_traces_match(reg_obj, test,
                                                 '%s TEST' % api)
     print(("### TEST Api: %s. %d traces. Matches/Timeouts/Fails %d/%d/%d" +
-          " test traces\n") % (api, len(kb[api]), success, tout, fails))
+          " test traces\n") % (api, len(kb_realizations(kb, api)),
+                               success, tout, fails))
     return (reg_obj, success, tout, fails)
 
 def regexes_for_kb(kb, syscalls, regexes=None):
-    symbols_generator({**kb, **syscalls})
+    symbols_generator({**dict.fromkeys(kb), **syscalls})
 
     if regexes is None:
         regexes = {}
-    for api, traces in kb.items():
+    for api in kb:
         print(api)
-        if avg_trace_length(traces) > 100:
+        if avg_trace_length(kb_realizations(kb, api)) > 100:
             print("%s traces too big. Skipping" % api)
             regexes[api] = ...
             continue
@@ -757,7 +731,7 @@ def regexes_for_kb(kb, syscalls, regexes=None):
     return regexes
 
 def test_regex(kb, api, regex):
-    traces = [x for x in kb[api] if len(x) != 0]
+    traces = [x for x in kb_realizations(kb, api) if len(x) != 0]
     return check_traces_match(regex, traces)
 
 
@@ -927,28 +901,13 @@ def regexes_split_test_results(regexes_test):
 
 
 def prune_kb_from_empties(kb, empties):
-    ret = {}
-    for api, traces in kb.items():
-        ret[api] = []
-        for trace in traces:
-            n_trace = []
-            for call in trace:
-                if call[1] not in empties:
-                    n_trace.append(call)
-            ret[api].append(n_trace)
-    return ret
+    return filter_kb(kb, kb_filter_chain(['empties'], empties=empties))
 
 def prune_kb_from_signals(kb):
-    ret = {}
-    for api, traces in kb.items():
-        ret[api] = []
-        for trace in traces:
-            new_trace = []
-            for call in trace:
-                if not signal_regex.match(call[1]):
-                    new_trace.append(call)
-            ret[api].append(new_trace)
-    return ret
+    ## Filtered when each API is loaded
+    if isinstance(kb, LazyKB):
+        return kb.map(remove_signal_lines)
+    return filter_kb(kb, kb_filter_chain(['signals']))
 
 def shuffle_kb(kb):
     for api, traces in kb.items():
@@ -999,25 +958,22 @@ def find_leaves_models(models, syscalls):
     return leaves_apis
 
 def kb_remove_hanging_calls(kb):
+    chain = kb_filter_chain(['hanging'], kb=kb)
+    stats = new_filter_stats(chain)
     for api, traces in kb.items():
         for trace in traces:
-            i = 0
-            while i < len(trace):
-                if trace[i][0] == 'API' and trace[i][1] not in kb:
-                    print("Removing call to %s from API %s" % (trace[i][1], api))
-                    del trace[i]
-                else:
-                    i += 1
+            trace[:] = filter_realization(chain, trace, stats)
+    print_filter_stats(stats)
 
 def overlapping_traces(kb, api):
     traces = {tuple(get_syscall_name(y[1])
                     for y in get_syscall_list_from_trace(x))
-              for x in kb[api]}
+              for x in kb_realizations(kb, api)}
     ret = []
-    for k, v in kb.items():
+    for k in kb:
          if k == api:
              continue
-         for t in v:
+         for t in kb_realizations(kb, k):
              if len(t) == 0:
                  continue
              if len(get_api_list_from_trace(t)) != 0:
@@ -0,0 +1,203 @@
+import struct
+import numpy as np
+
+## Binary parsed-trace format, written by convert_trace.py.
+##   magic
+##   header: timestamp scale, symbol table (every API and syscall string)
+##   number of threads, then one block per thread:
+##     tid, number of events, size of the ID, timestamp and line columns
+##     kind column:      one byte per event, SYS, API start or API end
+##     ID column:        varint symbol IDs
+##     timestamp column: zigzag varint deltas of the timestamps multiplied
+##                       by 10**scale, or float64 values if scale is 0
+##     line column:      varint deltas of the line numbers of the events in
+##                       the text trace
+## Integers are unsigned LEB128 varints. Blocks can be skipped with the
+## column sizes, so a single thread is read without decoding the others.
+## The reader returns the same tuples as utils.parse_lines.
+BINARY_TRACE_MAGIC = b'S2ATRC02'
+KIND_SYS, KIND_API_START, KIND_API_END = 0, 1, 2
+api_kinds = {'S': KIND_API_START, 'E': KIND_API_END}
+
+def is_binary_trace(path):
+    with open(path, 'rb') as f:
+        return f.read(len(BINARY_TRACE_MAGIC)) == BINARY_TRACE_MAGIC
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(f):
+    value = 0
+    shift = 0
+    while True:
+        b = f.read(1)[0]
+        value |= (b & 0x7f) << shift
+        if b < 0x80:
+            return value
+        shift += 7
+
+## Decode a buffer of varints at once
+def decode_varints(buf):
+    b = np.frombuffer(buf, dtype=np.uint8)
+    if len(b) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(b < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    group = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = (7 * (np.arange(len(b)) - starts[group])).astype(np.uint64)
+    return np.add.reduceat((b & 0x7f).astype(np.uint64) << shifts, starts)
+
+def zigzag(value):
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+def unzigzag(values):
+    values = values.astype(np.int64)
+    return (values >> 1) ^ -(values & 1)
+
+## Smallest scale at which the timestamps are stored exactly as integers,
+## 0 if there is none and they have to be stored as floats
+def timestamp_scale(timestamps):
+    for scale in (6, 9):
+        ints = [round(t * 10**scale) for t in timestamps]
+        if all(abs(x) < 2**53 for x in ints):
+            decoded = np.array(ints, dtype=np.float64) / 10**scale
+            if np.array_equal(decoded, np.array(timestamps, dtype=np.float64)):
+                return scale
+    return 0
+
+## threads is {tid: events}, with the events parse_lines returns with
+## time_flag set, and lines is {tid: line numbers of the events}, as
+## returned by utils.trace_line_numbers
+def write_binary_trace(threads, lines, path):
+    symbols = {}
+    timestamps = [e[1] for events in threads.values() for e in events]
+    scale = timestamp_scale(timestamps)
+
+    blocks = []
+    for tid, events in threads.items():
+        kinds = bytearray()
+        ids = bytearray()
+        times = bytearray()
+        last = 0
+        for e in events:
+            if e[0] == 'SYS':
+                kinds.append(KIND_SYS)
+                name = e[2]
+            else:
+                kinds.append(api_kinds[e[2]])
+                name = e[3]
+            encode_varint(symbols.setdefault(name, len(symbols)), ids)
+            if scale == 0:
+                times += struct.pack('<d', e[1])
+            else:
+                t = round(e[1] * 10**scale)
+                encode_varint(zigzag(t - last), times)
+                last = t
+        numbers = bytearray()
+        last = 0
+        for n in lines[tid]:
+            encode_varint(n - last, numbers)
+            last = n
+        blocks.append((tid, len(events), kinds, ids, times, numbers))
+
+    out = bytearray(BINARY_TRACE_MAGIC)
+    encode_varint(scale, out)
+    encode_varint(len(symbols), out)
+    for name in symbols:
+        data = name.encode()
+        encode_varint(len(data), out)
+        out += data
+    encode_varint(len(blocks), out)
+    for (tid, n, kinds, ids, times, numbers) in blocks:
+        for value in (tid, n, len(ids), len(times), len(numbers)):
+            encode_varint(value, out)
+        out += kinds + ids + times + numbers
+
+    with open(path, 'wb') as f:
+        f.write(out)
+
+def read_binary_header(f):
+    if f.read(len(BINARY_TRACE_MAGIC)) != BINARY_TRACE_MAGIC:
+        raise ValueError("%s is not a binary trace" % f.name)
+    scale = read_varint(f)
+    symbols = []
+    for _ in range(read_varint(f)):
+        symbols.append(f.read(read_varint(f)).decode())
+    return scale, symbols
+
+## Yield (tid, kinds, ids, times, lines) for the threads to read, only
+## skipping over the blocks of the other ones
+def read_binary_blocks(f, tids=None):
+    for _ in range(read_varint(f)):
+        (tid, n, ids_len, times_len, lines_len) = [read_varint(f)
+                                                   for _ in range(5)]
+        if tids is not None and tid not in tids:
+            f.seek(n + ids_len + times_len + lines_len, 1)
+            continue
+        yield (tid, f.read(n), f.read(ids_len), f.read(times_len),
+               f.read(lines_len))
+
+## The events without timestamps of each kind and symbol, built once per
+## file and shared by its blocks
+def event_templates(symbols):
+    return [[('SYS', s) for s in symbols],
+            [('API', 'S', s) for s in symbols],
+            [('API', 'E', s) for s in symbols]]
+
+def decode_block(kinds, ids, times, scale, symbols, time=False,
+                 templates=None):
+    ids = decode_varints(ids).tolist()
+    if not time:
+        if templates is None:
+            templates = event_templates(symbols)
+        return [templates[k][i] for (k, i) in zip(kinds, ids)]
+
+    if scale == 0:
+        times = np.frombuffer(times, dtype='<f8').tolist()
+    else:
+        times = (np.cumsum(unzigzag(decode_varints(times))).astype(np.float64)
+                 / 10**scale).tolist()
+    states = (None, 'S', 'E')
+    return [('SYS', t, symbols[i]) if k == KIND_SYS
+            else ('API', t, states[k], symbols[i])
+            for (k, i, t) in zip(kinds, ids, times)]
+
+def binary_trace_threads(path):
+    tids = []
+    with open(path, 'rb') as f:
+        read_binary_header(f)
+        for _ in range(read_varint(f)):
+            (tid, n, ids_len, times_len, lines_len) = [read_varint(f)
+                                                       for _ in range(5)]
+            tids.append(tid)
+            f.seek(n + ids_len + times_len + lines_len, 1)
+    return tids
+
+## Same result as utils.load_trace on the text trace. Without threads, the
+## events of all the threads are merged in the order of their lines in the
+## text trace
+def load_binary_trace(path, threads=True, time=False, tid=None):
+    with open(path, 'rb') as f:
+        scale, symbols = read_binary_header(f)
+        if tid is not None:
+            for (_, kinds, ids, times, _) in read_binary_blocks(f, {tid}):
+                return decode_block(kinds, ids, times, scale, symbols, time)
+            raise KeyError(tid)
+        templates = None if time else event_templates(symbols)
+        if threads:
+            return {t: decode_block(kinds, ids, times, scale, symbols, time,
+                                    templates)
+                    for (t, kinds, ids, times, _) in read_binary_blocks(f)}
+        events = []
+        numbers = []
+        for (_, kinds, ids, times, lines) in read_binary_blocks(f):
+            events += decode_block(kinds, ids, times, scale, symbols, time,
+                                   templates)
+            numbers.append(np.cumsum(decode_varints(lines)))
+    if len(events) == 0:
+        return events
+    order = np.argsort(np.concatenate(numbers))
+    return [events[i] for i in order.tolist()]
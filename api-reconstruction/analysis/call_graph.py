@@ -0,0 +1,132 @@
+import numpy as np
+
+from .dedup import kb_realizations
+
+## API call graph of a KB: an edge goes from an API to every API called in
+## one of its realizations. Nodes are numbered in KB order, followed by the
+## called APIs that aren't in the KB (they have no edges). The adjacency is
+## stored as CSR arrays, the successors of node i being
+## indices[indptr[i]:indptr[i+1]] in the order they are first called.
+## The strongly connected components are listed in reverse topological
+## order (every component comes after the ones it calls), so a single pass
+## over them computes the properties that depend on the called APIs.
+class APICallGraph(object):
+    def __init__(self, d):
+        self.apis = list(d.keys())
+        self.kb_size = len(self.apis)
+        self.ids = {api: i for i, api in enumerate(self.apis)}
+        indptr = [0]
+        indices = []
+        makes_syscalls = []
+        for api in self.apis[:self.kb_size]:
+            subapis = {}
+            sys = False
+            for r in kb_realizations(d, api):
+                for call in r:
+                    if call[0] == 'SYS':
+                        sys = True
+                        continue
+                    if call[1] not in self.ids:
+                        self.ids[call[1]] = len(self.apis)
+                        self.apis.append(call[1])
+                    subapis[self.ids[call[1]]] = None
+            indices += subapis.keys()
+            indptr.append(len(indices))
+            makes_syscalls.append(sys)
+        indptr += [len(indices)] * (len(self.apis) - self.kb_size)
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+        self.makes_syscalls = np.zeros(len(self.apis), dtype=bool)
+        self.makes_syscalls[:self.kb_size] = makes_syscalls
+        self._condense(indptr, indices)
+
+    def __len__(self):
+        return len(self.apis)
+
+    def successors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def in_kb(self, i):
+        return i < self.kb_size
+
+    ## APIs of the KB that don't call other APIs
+    def leaves(self):
+        return np.diff(self.indptr[:self.kb_size + 1]) == 0
+
+    ## Iterative Tarjan. Sets comp (component of each node), components
+    ## (their nodes, in reverse topological order) and cyclic (the
+    ## components in which an API can call itself)
+    def _condense(self, indptr, indices):
+        n = len(self.apis)
+        index = [-1] * n
+        low = [0] * n
+        on_stack = [False] * n
+        stack = []
+        comp = [-1] * n
+        components = []
+        counter = 0
+        for root in range(n):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [(root, indptr[root])]
+            while work:
+                (v, i) = work[-1]
+                if i < indptr[v+1]:
+                    work[-1] = (v, i + 1)
+                    w = indices[i]
+                    if index[w] == -1:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = True
+                        work.append((w, indptr[w]))
+                    elif on_stack[w] and index[w] < low[v]:
+                        low[v] = index[w]
+                    continue
+                work.pop()
+                if work and low[v] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[v]
+                if low[v] == index[v]:
+                    members = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        comp[w] = len(components)
+                        members.append(w)
+                        if w == v:
+                            break
+                    components.append(members)
+
+        self.comp = np.array(comp, dtype=np.int64)
+        self.components = components
+        self.cyclic = np.array([len(members) > 1 or
+                                any(indices[j] == members[0] for j in
+                                    range(indptr[members[0]],
+                                          indptr[members[0] + 1]))
+                                for members in components], dtype=bool)
+
+    ## For each flags array, whether each API reaches (in zero or more
+    ## calls) an API whose flag is set
+    def reaches(self, *flags):
+        ret = [np.zeros(len(self.apis), dtype=bool) for _ in flags]
+        comp_flags = [np.zeros(len(self.components), dtype=bool)
+                      for _ in flags]
+        for c, members in enumerate(self.components):
+            for (f, cf) in zip(flags, comp_flags):
+                if f[members].any():
+                    cf[c] = True
+            for v in members:
+                succ_comps = self.comp[self.successors(v)]
+                for cf in comp_flags:
+                    if not cf[c] and cf[succ_comps].any():
+                        cf[c] = True
+            for (r, cf) in zip(ret, comp_flags):
+                r[members] = cf[c]
+        return ret
+
+    def select(self, mask):
+        return {self.apis[i] for i in np.flatnonzero(mask[:self.kb_size])}
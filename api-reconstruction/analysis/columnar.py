@@ -0,0 +1,140 @@
+import json
+import numpy as np
+
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+
+from syscall2api.interned import is_interned_kb, iter_interned_kb
+
+## Columnar KB (CSR layout). All the realizations of all the APIs are
+## stored back to back in a single int32 array of events, encoded as in
+## the interned KB: (name ID << 1) | 1 for APIs, name ID << 1 for syscalls.
+##   events[realizations[i]:realizations[i+1]] is realization i
+##   realizations[apis[j]:apis[j+1]] are the realizations of API j
+## api_ids[j] is the name ID of API j. The arrays are saved as .npy files
+## in a directory and memory mapped when loaded.
+CSR_FILES = ('events', 'realizations', 'apis', 'api_ids')
+CSR_NAMES_FILE = 'names.json'
+CSR_SYSCALLS_FILE = 'syscalls.json'
+
+def is_csr_store(path):
+    return (Path(path) / 'events.npy').is_file()
+
+## Read-only {api: [realization, ...]} view of a columnar KB. Realizations
+## are decoded to lists of ('API'|'SYS', name) tuples when accessed.
+class CSRKB(Mapping):
+    def __init__(self, events, realizations, apis, api_ids, names):
+        self.events = events
+        self.realizations = realizations
+        self.apis = apis
+        self.api_ids = api_ids
+        self.names = names
+        self.index = {names[api_id]: j for j, api_id in
+                      enumerate(api_ids.tolist())}
+
+    def __getitem__(self, api):
+        return CSRRealizations(self, self.index[api])
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, api):
+        return api in self.index
+
+    def decode(self, i):
+        start, end = self.realizations[i], self.realizations[i+1]
+        return [('API' if event & 1 else 'SYS', self.names[event >> 1])
+                for event in self.events[start:end].tolist()]
+
+    ## Per API reductions over the events. counts is an array with one
+    ## entry per event; returns the sum of counts over each API
+    def sum_per_api(self, counts):
+        cumulative = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=cumulative[1:])
+        bounds = self.realizations[self.apis]
+        return cumulative[bounds[1:]] - cumulative[bounds[:-1]]
+
+    def events_per_api(self):
+        bounds = self.realizations[self.apis]
+        return bounds[1:] - bounds[:-1]
+
+    def api_calls_per_api(self):
+        return self.sum_per_api(self.events & 1)
+
+    def syscalls_per_api(self):
+        return self.sum_per_api(1 - (self.events & 1))
+
+    def select(self, mask):
+        return {self.names[api_id] for api_id in self.api_ids[mask].tolist()}
+
+## Realizations of a single API of a CSRKB
+class CSRRealizations(Sequence):
+    def __init__(self, kb, j):
+        self.kb = kb
+        self.first = int(kb.apis[j])
+        self.last = int(kb.apis[j+1])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.kb.decode(self.first + i)
+
+    def __len__(self):
+        return self.last - self.first
+
+    def total_length(self):
+        return int(self.kb.realizations[self.last] -
+                   self.kb.realizations[self.first])
+
+    def api_calls(self):
+        start = self.kb.realizations[self.first]
+        end = self.kb.realizations[self.last]
+        return int(np.count_nonzero(self.kb.events[start:end] & 1))
+
+def csr_from_kb(d):
+    if is_interned_kb(d):
+        d = dict(iter_interned_kb(d))
+    names = {}
+    events = []
+    realizations = [0]
+    apis = [0]
+    api_ids = []
+    for api, traces in d.items():
+        api_ids.append(names.setdefault(api, len(names)))
+        for trace in traces:
+            events += [(names.setdefault(name, len(names)) << 1) | (t == 'API')
+                       for (t, name) in trace]
+            realizations.append(len(events))
+        apis.append(len(realizations) - 1)
+    return CSRKB(np.array(events, dtype=np.int32),
+                 np.array(realizations, dtype=np.int64),
+                 np.array(apis, dtype=np.int64),
+                 np.array(api_ids, dtype=np.int32),
+                 list(names))
+
+def save_csr_kb(kb, syscalls, path):
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    for name in CSR_FILES:
+        np.save(path / (name + '.npy'), np.asarray(getattr(kb, name)))
+    with open(path / CSR_NAMES_FILE, 'w') as f:
+        json.dump(kb.names, f)
+    with open(path / CSR_SYSCALLS_FILE, 'w') as f:
+        json.dump(syscalls, f)
+
+def load_csr_kb(path, mmap_mode='r'):
+    path = Path(path)
+    arrays = [np.load(path / (name + '.npy'), mmap_mode=mmap_mode)
+              for name in CSR_FILES]
+    with open(path / CSR_NAMES_FILE, 'r') as f:
+        names = json.load(f)
+    with open(path / CSR_SYSCALLS_FILE, 'r') as f:
+        syscalls = json.load(f)
+    return CSRKB(*arrays, names), syscalls
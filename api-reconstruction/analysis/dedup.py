@@ -0,0 +1,102 @@
+## Deduplicated KB: for each API, its distinct argument-stripped
+## realizations, in the order they are first found, each with the number of
+## realizations of the original KB it stands for. Models only look at
+## syscall names, so they are trained and tested on the distinct
+## realizations weighted by their count.
+## It is pickled as {'__kb_format__': 'dedup', 'kb': {api: [(r, count)]}}
+DEDUP_FORMAT = 'dedup'
+
+## Same as utils.prune_syscalls_args
+def strip_syscalls_args(trace):
+    return [('SYS', call[1].split('(')[0]) if call[0] == 'SYS' else call
+            for call in trace]
+
+## It isn't a dict: the APIs can be iterated and tested like the keys of
+## a KB, but there is no kb[api], so code that expects a list of
+## realizations fails instead of reading the (r, count) pairs as
+## realizations. Use kb_realizations for code that handles both.
+class DedupKB(object):
+    def __init__(self, entries=None):
+        self._entries = dict(entries) if entries is not None else {}
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, api):
+        return api in self._entries
+
+    def keys(self):
+        return self._entries.keys()
+
+    ## [(r, count)] of an API
+    def entries(self, api):
+        return self._entries[api]
+
+    def entry_items(self):
+        return self._entries.items()
+
+    def counts(self, api):
+        return [count for (_, count) in self._entries[api]]
+
+    def realizations(self, api):
+        return [r for (r, _) in self._entries[api]]
+
+    def total(self, api):
+        return sum(self.counts(api))
+
+## Realizations of an API of any KB, the distinct ones for a DedupKB
+def kb_realizations(d, api):
+    if isinstance(d, DedupKB):
+        return d.realizations(api)
+    return d[api]
+
+def is_dedup_kb(kb):
+    return isinstance(kb, dict) and kb.get('__kb_format__') == DEDUP_FORMAT
+
+## Add the realizations to the {key: index} and [(r, count)] of an API
+def _add_realizations(seen, ret, realizations):
+    for (r, count) in realizations:
+        key = tuple(r)
+        if key in seen:
+            (old, old_count) = ret[seen[key]]
+            ret[seen[key]] = (old, old_count + count)
+        else:
+            seen[key] = len(ret)
+            ret.append((list(r), count))
+    return ret
+
+def dedup_realizations(traces):
+    return _add_realizations({}, [], ((strip_syscalls_args(t), 1)
+                                      for t in traces))
+
+def dedup_kb(kb):
+    if isinstance(kb, DedupKB):
+        return kb
+    return DedupKB({api: dedup_realizations(traces)
+                    for api, traces in kb.items()})
+
+## Apply func to every distinct realization, merging those that become
+## equal
+def map_dedup_kb(kb, func):
+    return DedupKB({api: _add_realizations({}, [], ((func(r), count)
+                                                    for (r, count) in rs))
+                    for api, rs in kb.entry_items()})
+
+def expand_kb(kb):
+    return {api: [list(r) for (r, count) in rs for _ in range(count)]
+            for api, rs in kb.entry_items()}
+
+def dedup_kb_to_pickle(kb):
+    return {'__kb_format__': DEDUP_FORMAT, 'kb': dict(kb.entry_items())}
+
+## What to pickle for a KB, a DedupKB is pickled with builtin types only
+def kb_to_pickle(kb):
+    if isinstance(kb, DedupKB):
+        return dedup_kb_to_pickle(kb)
+    return kb
+
+def dedup_kb_from_pickle(d):
+    return DedupKB(d['kb'])
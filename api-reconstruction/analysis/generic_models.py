@@ -1,27 +1,38 @@
 from .classes import *
+from .dedup import DedupKB, kb_realizations
 
 class APIGenericModel(RegexAlternative):
-    def __init__(self, api, realizations, train_size=-1):
+    ## counts[i] is the number of occurrences of realizations[i], when the
+    ## realizations come from a DedupKB
+    def __init__(self, api, realizations, train_size=-1, counts=None):
         super().__init__(set(), RegexFlags.MANDATORY)
         self._api = api
+        if counts is None:
+            counts = [1] * len(realizations)
 
         if train_size == -1:
-            train_size = min(50, math.ceil(len(realizations)/2))
+            train_size = min(50, math.ceil(sum(counts)/2))
 
         self._train = []
         self._redundant = []
+        ## Realizations matched by the models without training them,
+        ## including the repetitions of the training ones
+        self._redundant_count = 0
 
         i = 0
         j = 0
         while j < train_size and i < len(realizations):
             if self.add_model(realizations[i]):
                 self._train.append(realizations[i])
+                self._redundant_count += counts[i] - 1
                 j += 1
             else:
                 self._redundant.append(realizations[i])
+                self._redundant_count += counts[i]
             i += 1
         self._train_size = j
         self._test = realizations[i:]
+        self._test_counts = counts[i:]
 
         print("API %s -> %d train, %d redundant, %d test" %
               (api, self._train_size, len(self._redundant), len(self._test)))
@@ -55,16 +66,19 @@ class APIGenericModel(RegexAlternative):
         return False
 
 
-    def test(self, test=None):
+    def test(self, test=None, counts=None):
         if test is None:
             test = self._test
-        successes = len(self._redundant)
+            counts = self._test_counts
+        if counts is None:
+            counts = [1] * len(test)
+        successes = self._redundant_count
         fails = 0
-        for trace in test:
+        for trace, count in zip(test, counts):
             if self.check_trace(trace):
-                successes += 1
+                successes += count
             else:
-                fails += 1
+                fails += count
         self.test_results = (successes, fails)
         return self.test_results
 
@@ -104,17 +118,24 @@ class APIGenericModel(RegexAlternative):
     def model_for_api(cls, kb, api, debug=False):
         if debug:
             from .analysis_internals import symbols_generator
+            from .analysis_internals import all_symbols_for_api
             del symbols_generator._symbols
             symbols_generator(all_symbols_for_api(kb, api), start=65)
 
-        traces = [t for t in kb[api] if len(t) != 0]
+        if isinstance(kb, DedupKB):
+            weighted = [(t, c) for (t, c) in kb.entries(api) if len(t) != 0]
+            traces = [t for (t, _) in weighted]
+            counts = [c for (_, c) in weighted]
+        else:
+            traces = [t for t in kb[api] if len(t) != 0]
+            counts = None
 
         if len(traces) == 0:
             return None
 
-        allow_empty = len(traces) != len(kb[api])
+        allow_empty = len(traces) != len(kb_realizations(kb, api))
 
-        m = cls(api, traces)
+        m = cls(api, traces, counts=counts)
         m._empty_allowed = allow_empty
         m.test()
         return m
@@ -124,13 +145,13 @@ class APIGenericModel(RegexAlternative):
         from .analysis_internals import symbols_generator
         if hasattr(symbols_generator, '_symbols'):
             del symbols_generator._symbols
-        symbols_generator({**kb, **syscalls})
+        symbols_generator({**dict.fromkeys(kb), **syscalls})
 
         if models is None:
             models = {}
 
         from .analysis_internals import dump_to_file
-        for api, traces in kb.items():
+        for api in kb:
             print(api)
             if api not in models or models[api] is None:
                 models[api] = cls.model_for_api(kb, api)
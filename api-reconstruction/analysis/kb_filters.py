@@ -0,0 +1,141 @@
+import os
+import json
+
+from .dedup import DedupKB, map_dedup_kb
+
+## KB cleaning as a chain of filters applied to each realization in a
+## single pass over the KB. A filter maps a realization to the filtered
+## realization. Filters are registered by name, the ones that depend on
+## the KB (e.g. the set of empty APIs) are built by a factory taking the
+## context given to kb_filter_chain. The number of events and of
+## realizations each filter changed is counted in the filter stats.
+## All the filters are registered in this module.
+registered_kb_filters = {}
+kb_filter_factories = {}
+
+def register_kb_filter(name, func):
+    registered_kb_filters[name] = func
+    return func
+
+def register_kb_filter_factory(name, factory):
+    kb_filter_factories[name] = factory
+    return factory
+
+## Remove the calls to the given APIs
+def empties_filter(empties):
+    return lambda trace: [call for call in trace if call[1] not in empties]
+
+## Remove the calls to APIs that aren't in the KB
+def hanging_calls_filter(apis):
+    return lambda trace: [call for call in trace
+                          if call[0] != 'API' or call[1] in apis]
+
+register_kb_filter_factory('empties',
+                           lambda context: empties_filter(context['empties']))
+register_kb_filter_factory('hanging',
+                           lambda context: hanging_calls_filter(
+                               set(context['kb'].keys())))
+
+## The filters defined with the rest of the analysis. Those modules import
+## this one, so they are imported (and registered again, which is
+## harmless) whenever a chain is built.
+def register_analysis_kb_filters():
+    from .analysis_internals import prune_malloc_syscalls
+    from .analysis_internals import remove_noisy_syscalls, remove_signal_lines
+    from .trace_analysis import prune_signal_handlings
+    register_kb_filter('malloc', prune_malloc_syscalls)
+    register_kb_filter('noisy', remove_noisy_syscalls)
+    register_kb_filter('signals', remove_signal_lines)
+    register_kb_filter('signal_handlings', prune_signal_handlings)
+
+## [(name, filter)] of the given filter names
+def kb_filter_chain(names, **context):
+    register_analysis_kb_filters()
+    chain = []
+    for name in names:
+        if name in registered_kb_filters:
+            chain.append((name, registered_kb_filters[name]))
+        elif name in kb_filter_factories:
+            chain.append((name, kb_filter_factories[name](context)))
+        else:
+            raise ValueError("Unknown KB filter %s, available filters: %s" %
+                             (name, ', '.join(sorted(
+                                 registered_kb_filters.keys() |
+                                 kb_filter_factories))))
+    return chain
+
+def new_filter_stats(chain):
+    return {name: {'events': 0, 'realizations': 0} for (name, _) in chain}
+
+def merge_filter_stats(stats, other):
+    for name, s in other.items():
+        for key, value in s.items():
+            stats[name][key] += value
+    return stats
+
+def filter_realization(chain, trace, stats, count=1):
+    for (name, func) in chain:
+        length = len(trace)
+        trace = func(trace)
+        if len(trace) != length:
+            stats[name]['events'] += (length - len(trace)) * count
+            stats[name]['realizations'] += count
+    return trace
+
+## Apply the chain to every realization, one API at a time. With consume,
+## the APIs are deleted from kb once filtered, so the original and the
+## filtered KB are never both in memory
+def filter_kb(kb, chain, stats=None, consume=False):
+    if stats is None:
+        stats = new_filter_stats(chain)
+    if isinstance(kb, DedupKB):
+        ret = {}
+        for api, rs in kb.entry_items():
+            ret[api] = [(filter_realization(chain, r, stats, count), count)
+                        for (r, count) in rs]
+        return map_dedup_kb(DedupKB(ret), lambda r: r)
+    ret = {}
+    for api in list(kb.keys()):
+        ret[api] = [filter_realization(chain, trace, stats)
+                    for trace in kb[api]]
+        ## Columnar KBs are read-only and memory mapped
+        if consume and isinstance(kb, dict):
+            del kb[api]
+    return ret
+
+def print_filter_stats(stats):
+    for name, s in stats.items():
+        print("%s: %d events removed from %d realizations" %
+              (name, s['events'], s['realizations']))
+
+def store_filter_stats(stats, path):
+    with open(path, 'w') as f:
+        json.dump(stats, f, indent=1)
+
+## Filters already applied to a KB file, recorded next to it by the
+## scripts that write a filtered KB. The size and mtime of the KB file are
+## stored with them, so a KB rewritten by something else isn't trusted.
+## The stamp of a KB directory (e.g. a partitioned KB) is the one of each
+## of its files.
+applied_filters_suffix = '.filters'
+
+def _kb_stamp(kb_file):
+    if os.path.isdir(kb_file):
+        return [[name] + _kb_stamp(os.path.join(kb_file, name))
+                for name in sorted(os.listdir(kb_file))]
+    st = os.stat(kb_file)
+    return [st.st_size, st.st_mtime_ns]
+
+def store_applied_filters(kb_file, names):
+    with open(kb_file + applied_filters_suffix, 'w') as f:
+        json.dump({'filters': list(names), 'stamp': _kb_stamp(kb_file)}, f)
+
+def load_applied_filters(kb_file):
+    try:
+        with open(kb_file + applied_filters_suffix, 'r') as f:
+            applied = json.load(f)
+        if applied['stamp'] == _kb_stamp(kb_file):
+            return applied['filters']
+    except (OSError, ValueError, KeyError):
+        pass
+    return []
@@ -0,0 +1,113 @@
+import io
+import copy
+import os
+import mmap
+import pickle
+import struct
+
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from .dedup import DedupKB
+
+## Single file KB with random access to the APIs, written by convert_kb.py
+## --lazy:
+##   magic
+##   one pickled record per API: its list of realizations
+##   pickled index {api: (offset, size)} in KB order, then the syscalls
+##   footer: offset of the index (uint64), magic
+## The file is memory mapped and a record is only unpickled when its API is
+## accessed, so looking at one API doesn't load the whole KB.
+LAZY_KB_MAGIC = b'S2AKBX01'
+LAZY_KB_CACHE_SIZE = int(os.environ.get('LAZY_KB_CACHE_SIZE', 1024))
+lazy_kb_footer = struct.Struct('<Q8s')
+
+def is_lazy_kb(path):
+    with open(path, 'rb') as f:
+        return f.read(len(LAZY_KB_MAGIC)) == LAZY_KB_MAGIC
+
+## The realizations of a deduplicated KB are expanded as in expand_kb, a
+## lazy KB always reads as a plain one
+def save_lazy_kb(kb, syscalls, path):
+    index = {}
+    with open(path + '.tmp', 'wb') as f:
+        f.write(LAZY_KB_MAGIC)
+        for api in kb:
+            if isinstance(kb, DedupKB):
+                realizations = [list(r) for (r, count) in kb.entries(api)
+                                for _ in range(count)]
+            else:
+                realizations = list(kb[api])
+            data = pickle.dumps(realizations, pickle.HIGHEST_PROTOCOL)
+            index[api] = (f.tell(), len(data))
+            f.write(data)
+        index_offset = f.tell()
+        pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(syscalls, f, pickle.HIGHEST_PROTOCOL)
+        f.write(lazy_kb_footer.pack(index_offset, LAZY_KB_MAGIC))
+    os.replace(path + '.tmp', path)
+
+## Read-only {api: [realization, ...]} view of a lazy KB. The realizations
+## of the cache_size most recently used APIs are kept in memory. transform,
+## if given, is applied to every realization when it is loaded.
+## kb[api] returns a copy of the cached realizations, so changing it
+## doesn't change the KB (and isn't lost when the API leaves the cache).
+class LazyKB(Mapping):
+    def __init__(self, path, cache_size=LAZY_KB_CACHE_SIZE, transform=None):
+        self.path = path
+        self.cache_size = cache_size
+        self.transform = transform
+        self.cache = OrderedDict()
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (index_offset, magic) = lazy_kb_footer.unpack(
+            self.data[-lazy_kb_footer.size:])
+        if magic != LAZY_KB_MAGIC:
+            self.data.close()
+            raise ValueError("%s is not a lazy KB" % path)
+        index_end = len(self.data) - lazy_kb_footer.size
+        (self.index, self.syscalls) = self._load_index(index_offset, index_end)
+
+    def _load_index(self, start, end):
+        f = io.BytesIO(self.data[start:end])
+        return pickle.load(f), pickle.load(f)
+
+    def __getitem__(self, api):
+        if api in self.cache:
+            self.cache.move_to_end(api)
+        else:
+            (offset, size) = self.index[api]
+            realizations = pickle.loads(self.data[offset:offset + size])
+            if self.transform is not None:
+                realizations = [self.transform(r) for r in realizations]
+            self.cache[api] = realizations
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return [list(r) for r in self.cache[api]]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, api):
+        return api in self.index
+
+    ## Another view of the same file, with func applied to the realizations
+    ## after the current transform. The views share the memory mapping and
+    ## the index, closing one closes them all.
+    def map(self, func):
+        view = copy.copy(self)
+        view.transform = func if self.transform is None else \
+            (lambda r, t=self.transform: func(t(r)))
+        view.cache = OrderedDict()
+        return view
+
+    def close(self):
+        self.cache.clear()
+        self.data.close()
+
+def load_lazy_kb(path, cache_size=LAZY_KB_CACHE_SIZE):
+    kb = LazyKB(path, cache_size)
+    return kb, kb.syscalls
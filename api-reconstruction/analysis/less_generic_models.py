@@ -1,5 +1,6 @@
 from multiprocessing import Pool
 from .classes import *
+from .dedup import DedupKB, kb_realizations
 import itertools
 
 class RegexGeneralizableSequence(RegexSequence):
@@ -27,33 +28,45 @@ class RegexGeneralizableSequence(RegexSequence):
 
 class APILessGenericModel(RegexAlternative):
     MAX_TRAIN_SIZE = 100
-    def __init__(self, api, realizations, train_size=-1, ntraces=None):
+    ## counts[i] is the number of occurrences of realizations[i], when the
+    ## realizations come from a DedupKB
+    def __init__(self, api, realizations, train_size=-1, ntraces=None,
+                 counts=None):
         super().__init__(set(), RegexFlags.MANDATORY)
         self._api = api
         self._traces = realizations
+        if counts is None:
+            counts = [1] * len(realizations)
+        self._counts = counts
         if ntraces is None:
-            self._ntraces = len(self._traces)
+            self._ntraces = sum(counts)
         else:
             self._ntraces = ntraces
 
         if train_size == -1:
             train_size = min(APILessGenericModel.MAX_TRAIN_SIZE,
-                             math.ceil(len(realizations)/2))
+                             math.ceil(sum(counts)/2))
 
         self._train = []
         self._redundant = []
+        ## Realizations matched by the models without training them,
+        ## including the repetitions of the training ones
+        self._redundant_count = 0
 
         i = 0
         j = 0
         while j < train_size and i < len(realizations):
             if self.add_model(realizations[i]):
                 self._train.append(realizations[i])
+                self._redundant_count += counts[i] - 1
                 j += 1
             else:
                 self._redundant.append(realizations[i])
+                self._redundant_count += counts[i]
             i += 1
         self._train_size = j
         self._test = realizations[i:]
+        self._test_counts = counts[i:]
 
         print("API %s -> %d train, %d redundant, %d test" %
               (api, self._train_size, len(self._redundant), len(self._test)))
@@ -124,16 +137,19 @@ class APILessGenericModel(RegexAlternative):
         return False
 
 
-    def test(self, test=None):
+    def test(self, test=None, counts=None):
         if test is None:
             test = self._test
-        successes = len(self._redundant)
+            counts = self._test_counts
+        if counts is None:
+            counts = [1] * len(test)
+        successes = self._redundant_count
         fails = 0
-        for trace in test:
+        for trace, count in zip(test, counts):
             if self.check_trace(trace):
-                successes += 1
+                successes += count
             else:
-                fails += 1
+                fails += count
         self.test_results = (successes, fails)
         return self.test_results
 
@@ -142,9 +158,10 @@ class APILessGenericModel(RegexAlternative):
             raise Exception("count_matches can be used" +
                             " only if the original traces are available")
         self._counters = {k: 0 for k in self.expr}
-        for model, trace in itertools.product(self.expr, self._traces):
+        for model, (trace, count) in itertools.product(
+                self.expr, zip(self._traces, self._counts)):
             if model.match_trace(trace, full=True):
-                self._counters[model] += 1
+                self._counters[model] += count
         self._counters['TOTAL'] = self._ntraces
 
     ## Avoid serialization of the training and test sets.
@@ -155,6 +172,8 @@ class APILessGenericModel(RegexAlternative):
         del d['_train']
         del d['_test']
         del d['_redundant']
+        del d['_counts']
+        del d['_test_counts']
         return d
 
     def __setstate__(self, d):
@@ -163,6 +182,8 @@ class APILessGenericModel(RegexAlternative):
         d['_train'] = None
         d['_test'] = None
         d['_redundant'] = None
+        d['_counts'] = None
+        d['_test_counts'] = None
         self.__dict__ = d
 
     def __len__(self):
@@ -201,18 +222,25 @@ class APILessGenericModel(RegexAlternative):
     def model_for_api(cls, kb, api, debug=False):
         if debug:
             from .analysis_internals import symbols_generator
+            from .analysis_internals import all_symbols_for_api
             del symbols_generator._symbols
             symbols_generator(all_symbols_for_api(kb, api), start=65)
 
-        traces = [t for t in kb[api] if len(t) != 0]
-        ntraces = len(traces)
+        if isinstance(kb, DedupKB):
+            weighted = [(t, c) for (t, c) in kb.entries(api) if len(t) != 0]
+            traces = [t for (t, _) in weighted]
+            counts = [c for (_, c) in weighted]
+        else:
+            traces = [t for t in kb[api] if len(t) != 0]
+            counts = [1] * len(traces)
+        ntraces = sum(counts)
 
         if len(traces) == 0:
             return None
 
-        allow_empty = len(traces) != len(kb[api])
+        allow_empty = len(traces) != len(kb_realizations(kb, api))
 
-        m = cls(api, traces, ntraces=ntraces)
+        m = cls(api, traces, ntraces=ntraces, counts=counts)
         m._empty_allowed = allow_empty
         # m.test()
         # m.count_matches()
@@ -229,13 +257,13 @@ class APILessGenericModel(RegexAlternative):
         from .analysis_internals import symbols_generator, dump_to_file
         if hasattr(symbols_generator, '_symbols'):
             del symbols_generator._symbols
-        symbols_generator({**kb, **syscalls})
+        symbols_generator({**dict.fromkeys(kb), **syscalls})
 
         if models is None:
             models = {}
 
         if not parallel:
-            for api, traces in kb.items():
+            for api in kb:
                 print(api)
                 if api not in models or models[api] is None:
                     models[api] = cls.model_for_api(kb, api)
@@ -243,7 +271,11 @@ class APILessGenericModel(RegexAlternative):
                         dump_to_file(models, 'models2.pickle')
         else:
             pool = Pool(8)
-            args = (({api:kb[api]}, api) for api in kb.keys())
+            ## Only the API goes to the worker, as a plain dict (or a
+            ## DedupKB), whatever the type of the KB
+            args = ((DedupKB({api: kb.entries(api)})
+                     if isinstance(kb, DedupKB) else {api: kb[api]},
+                     api) for api in kb.keys())
             models = dict(pool.starmap(cls.model_for_api_parallel,
                                        args, chunksize=100))
             pool.close()
@@ -0,0 +1,25 @@
+import os
+import json
+import pickle
+from pathlib import Path
+
+from syscall2api.partitions import *
+
+## Partitioned KBs (read_full_log.py --partitions) are read with
+## syscall2api.partitions.
+
+## Write finalized partitions, e.g. the pruned partitions of a partitioned
+## KB. Partition i of kbs must hold the APIs of partition i of the input.
+def save_partitioned_kb(path, kbs, syscalls):
+    os.makedirs(path, exist_ok=True)
+    n = 0
+    for (i, kb) in enumerate(kbs):
+        with open(partition_kb_file(path, i), 'wb') as f:
+            pickle.dump(kb, f)
+            pickle.dump(0, f)
+        n += 1
+    with open(Path(path) / partition_syscalls_filename, 'wb') as f:
+        pickle.dump(syscalls, f)
+        pickle.dump(None, f)
+    with open(Path(path) / partitions_filename, 'w') as f:
+        json.dump({'partitions': n}, f)
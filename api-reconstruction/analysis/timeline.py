@@ -0,0 +1,94 @@
+import numpy as np
+
+from .utils import load_trace
+
+## Time index of a trace, to find what a thread did between two timestamps
+## without scanning it, e.g. to line it up with the binder or logcat
+## timelines. For each thread:
+##   times:  float64 timestamps of the events, sorted
+##   events: the events parse_lines returns with time_flag set, in the
+##           same order
+##   API interval table: name, start and end timestamps of each API call,
+##           sorted by start. Calls that never end last until +inf.
+##           api_max_end[i] is the latest end of the first i+1 calls, it
+##           never decreases, so the calls that end before a time are
+##           skipped with a binary search.
+class ThreadTimeline(object):
+    def __init__(self, tid, events):
+        self.tid = tid
+        times = np.array([e[1] for e in events], dtype=np.float64)
+        order = np.argsort(times, kind='stable')
+        self.times = times[order]
+        self.events = [events[i] for i in order]
+        self._build_api_table()
+
+    ## An end event closes the most recent open call of the same API. Unlike
+    ## compute_trace, the calls left open on top of it aren't unwound: they
+    ## are closed by their own end events, or last until +inf.
+    def _build_api_table(self):
+        open_calls = {}
+        intervals = []
+        for e in self.events:
+            if e[0] != 'API':
+                continue
+            (_, time, state, api) = e
+            if state == 'S':
+                open_calls.setdefault(api, []).append(len(intervals))
+                intervals.append([api, time, np.inf])
+            elif open_calls.get(api):
+                intervals[open_calls[api].pop()][2] = time
+        self.api_names = [x[0] for x in intervals]
+        self.api_start = np.array([x[1] for x in intervals], dtype=np.float64)
+        self.api_end = np.array([x[2] for x in intervals], dtype=np.float64)
+        self.api_max_end = np.maximum.accumulate(self.api_end) \
+            if len(intervals) else self.api_end
+
+    ## Indexes of the first and past the last event in [t1, t2]
+    def span(self, t1, t2):
+        return (int(np.searchsorted(self.times, t1, side='left')),
+                int(np.searchsorted(self.times, t2, side='right')))
+
+    def events_between(self, t1, t2):
+        (start, end) = self.span(t1, t2)
+        return self.events[start:end]
+
+    def syscalls_between(self, t1, t2):
+        return [e for e in self.events_between(t1, t2) if e[0] == 'SYS']
+
+    ## (api, start, end) of the API calls overlapping [t1, t2], in the order
+    ## they start. The calls before first all end before t1, the ones from
+    ## last on start after t2, only the ones in between are checked.
+    def apis_between(self, t1, t2):
+        first = int(np.searchsorted(self.api_max_end, t1, side='left'))
+        last = int(np.searchsorted(self.api_start, t2, side='right'))
+        hits = first + np.flatnonzero(self.api_end[first:last] >= t1)
+        return [(self.api_names[i], float(self.api_start[i]),
+                 float(self.api_end[i])) for i in hits]
+
+    ## API calls running at time t, outermost first
+    def apis_at(self, t):
+        return self.apis_between(t, t)
+
+class TraceTimeline(object):
+    def __init__(self, threads):
+        self.threads = {tid: ThreadTimeline(tid, events)
+                        for tid, events in threads.items()}
+
+    @classmethod
+    def load(cls, path):
+        return cls(load_trace(path, threads=True, time=True))
+
+    ## (APIs, syscalls) of thread tid in [t1, t2]
+    def window(self, tid, t1, t2):
+        thread = self.threads[tid]
+        return (thread.apis_between(t1, t2), thread.syscalls_between(t1, t2))
+
+    ## {tid: (APIs, syscalls)} of the threads active in [t1, t2]
+    def window_all(self, t1, t2):
+        ret = {}
+        for tid, thread in self.threads.items():
+            (apis, syscalls) = (thread.apis_between(t1, t2),
+                                thread.syscalls_between(t1, t2))
+            if len(apis) or len(syscalls):
+                ret[tid] = (apis, syscalls)
+        return ret
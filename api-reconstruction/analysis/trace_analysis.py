@@ -44,13 +44,13 @@ class Trace(object):
         self.__dict__ = dict(d)
 
     def reload(self):
-        self.trace = load_trace(self._path)[self._thread]
+        self.trace = load_trace(self._path, tid=self._thread)
         self.remove_noise()
         self.get_apis()
 
     @classmethod
     def gen(cls, path, thread):
-        t = load_trace(path)[thread]
+        t = load_trace(path, tid=thread)
         return cls(path, thread, t)
 
     @staticmethod
@@ -60,7 +60,7 @@ class Trace(object):
 
     @staticmethod
     def get_threads(trace_file):
-        return list(load_trace(trace_file).keys())
+        return trace_threads(trace_file)
 
     def first_api(self):
         if not self._has_apis:
@@ -241,7 +241,6 @@ def prune_signal_handlings(trace):
                 continue
     return ret
 
-
 def trace_trim_syscalls(trace):
     ret = []
     trace = prune_signal_handlings(prune_malloc_syscalls(trace))
@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import pickle
+import hashlib
+from pathlib import Path
+
+## On-disk cache of parsed traces, shared by every process that uses the
+## same cache directory. Entries are keyed by the content hash of the trace
+## file and by what was loaded (threads, time flag, tid). The hash of a
+## file is recomputed only when its path, size or mtime change. The least
+## recently used entries are removed once the cache grows over
+## trace_cache_max_size.
+## The cache is disabled unless trace_cache_dir is set, e.g. with the
+## TRACE_CACHE_DIR environment variable.
+## Several processes can use the cache at the same time: files are replaced
+## atomically, an entry removed by another process is a miss, and an
+## update of the hashes lost to a concurrent writer only means a file is
+## hashed again.
+trace_cache_dir = os.environ.get('TRACE_CACHE_DIR')
+trace_cache_max_size = int(os.environ.get('TRACE_CACHE_MAX_SIZE', 4 << 30))
+trace_hashes_file = 'hashes.json'
+
+def _write_atomic(path, data):
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _load_hashes():
+    path = Path(trace_cache_dir) / trace_hashes_file
+    if not path.is_file():
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def trace_content_hash(path, block_size=1 << 20):
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    stamp = [st.st_size, st.st_mtime_ns]
+    hashes = _load_hashes()
+    if key in hashes and hashes[key][:2] == stamp:
+        return hashes[key][2]
+
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    ## Read-modify-write of the whole file, the last writer wins
+    hashes = _load_hashes()
+    hashes[key] = stamp + [h.hexdigest()]
+    try:
+        _write_atomic(Path(trace_cache_dir) / trace_hashes_file,
+                      json.dumps(hashes).encode())
+    except OSError:
+        pass
+    return h.hexdigest()
+
+def trace_cache_key(path, threads=True, time=False, tid=None):
+    what = 'thread%s' % tid if tid is not None else \
+        ('threads' if threads else 'flat')
+    return '%s_%s_%s' % (trace_content_hash(path), what,
+                         'time' if time else 'notime')
+
+def trace_cache_get(key):
+    path = Path(trace_cache_dir) / (key + '.pickle')
+    try:
+        with open(path, 'rb') as f:
+            ret = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    ## The mtime of an entry is the time of its last use
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return ret
+
+def trace_cache_put(key, value):
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    if len(data) > trace_cache_max_size:
+        return
+    _write_atomic(Path(trace_cache_dir) / (key + '.pickle'), data)
+    trace_cache_evict()
+
+def trace_cache_evict(max_size=None):
+    if max_size is None:
+        max_size = trace_cache_max_size
+    entries = []
+    for entry in os.scandir(trace_cache_dir):
+        if entry.name.endswith('.pickle'):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+    total = sum(size for (_, size, _) in entries)
+    for (_, size, path) in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+## Load a trace through the cache with loader(path, threads, time, tid)
+def cached_trace(loader, path, threads=True, time=False, tid=None):
+    try:
+        os.makedirs(trace_cache_dir, exist_ok=True)
+        key = trace_cache_key(path, threads, time, tid)
+    except OSError as e:
+        print("Trace cache disabled: %s" % e, file=sys.stderr)
+        return loader(path, threads, time, tid)
+    ret = trace_cache_get(key)
+    if ret is None:
+        ret = loader(path, threads, time, tid)
+        try:
+            trace_cache_put(key, ret)
+        except OSError as e:
+            print("Cannot cache %s: %s" % (path, e), file=sys.stderr)
+    return ret
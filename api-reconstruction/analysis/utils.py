@@ -1,17 +1,53 @@
-import pickle, shelve
+import pickle, shelve, json
+import gzip, lzma, bz2
+import io, os, mmap
+from array import array
 from pathlib import Path
 import sys, re
 
-def load_kb(kb_file='kb_no_empties.pickle'):
+from syscall2api.tokenizer import tokenize_full_line
+from syscall2api.interned import is_interned_kb, unintern_kb
+from .columnar import is_csr_store, load_csr_kb
+from .binary_trace import is_binary_trace, load_binary_trace
+from .binary_trace import binary_trace_threads
+from . import trace_cache
+from .dedup import is_dedup_kb, dedup_kb_from_pickle
+from .partitions import is_partitioned_kb, load_partitioned_kb
+from .lazy_kb import is_lazy_kb, load_lazy_kb
+from syscall2api.kb_store import load_sharded_db
+
+## Interned KBs are converted back to {api: [realization, ...]}
+## unless unintern is False. Columnar KBs (convert_kb.py) are memory
+## mapped and returned as a read-only CSRKB, deduplicated KBs as a DedupKB,
+## and lazy KBs (convert_kb.py --lazy) as a LazyKB that loads each API
+## when it is first accessed
+def load_kb(kb_file='kb_no_empties.pickle', unintern=True):
+    if Path(kb_file).is_dir() and is_csr_store(kb_file):
+        return load_csr_kb(kb_file)
+    if Path(kb_file).is_dir() and is_partitioned_kb(kb_file):
+        return load_partitioned_kb(kb_file)
+    if Path(kb_file).is_dir():
+        return load_kb_shards(kb_file)
     if not Path(kb_file).is_file():
         print("Error: No KB file found", file=sys.stderr)
         return
+    if is_lazy_kb(kb_file):
+        return load_lazy_kb(kb_file)
 
     with open(kb_file, "rb") as pf:
         d = pickle.load(pf)
         syscalls = pickle.load(pf)
+    if unintern and is_interned_kb(d):
+        d = unintern_kb(d)
+    if is_dedup_kb(d):
+        d = dedup_kb_from_pickle(d)
     return d, syscalls
 
+## Sharded KB store written by read_full_log.py --store: the KB is the
+## union of the shards listed in the manifest, in ingestion order
+def load_kb_shards(store):
+    return load_sharded_db(store)
+
 def load_symbols(symbols_file = 'symbols.pickle'):
     if not Path(symbols_file).is_file():
         print("Error: No symbols file found", file=sys.stderr)
@@ -87,18 +123,26 @@ def prune_syscalls_args(trace):
 def tupletostring(t):
     return '_'.join(str(x) for x in t)
 
+## Trace files may be compressed, they are decompressed while they are read
+compressed_openers = {'.gz': gzip.open, '.xz': lzma.open, '.bz2': bz2.open}
+
+def open_trace(path, mode='r'):
+    opener = compressed_openers.get(Path(path).suffix)
+    if opener is None:
+        return open(path, mode)
+    return opener(path, mode + 't' if 'b' not in mode else mode)
+
 def read_trace_file(fp, threads=True):
     if threads:
         return read_trace_file_threads(fp)
-    return fp.readlines()
+    return list(fp)
+
+trace_entry_re = re.compile(r"^[\d\.]+\s[A-Z]+\s(\d{1,6})\s.*$")
 
 ## Return a dictionary with a trace (list of strings) for each thread
 def read_trace_file_threads(fp):
-    trace_entry_re = re.compile(r"^[\d\.]+\s[A-Z]+\s(\d{1,6})\s.*$")
-
     threads = {}
-    lines = fp.readlines()
-    for line in lines:
+    for line in fp:
         m = trace_entry_re.match(line)
         if m:
             t = int(m.groups()[0])
@@ -107,35 +151,129 @@ def read_trace_file_threads(fp):
             threads[t].append(line)
     return threads
 
-syscall_entry_re = re.compile(r"^(.*)SYSCALL\s([\d]{1,6})\s(.*)$")
-api_call_entry_re = re.compile(r"^(.*)(ANDROID|JAVA)\s(\d{1,6})\s(S|E)\s(.*)$")
+## Line numbers in the file of the lines of each thread, in the order
+## read_trace_file_threads returns them
+def trace_line_numbers(path):
+    threads = {}
+    with open_trace(path) as fp:
+        for n, line in enumerate(fp):
+            m = trace_entry_re.match(line)
+            if m:
+                threads.setdefault(int(m.groups()[0]), []).append(n)
+    return threads
+
 def parse_lines(trace, time_flag=False):
     ret = []
     for line in trace:
-        m = syscall_entry_re.match(line)
-        if m:
-            (time, tid, syscall) = m.groups()
-            entry = ("SYS", syscall) if not time_flag else ("SYS",
-                                                            float(time),
-                                                            syscall)
-            ret.append(entry)
+        tokens = tokenize_full_line(line, syscall_first=True)
+        if tokens is None:
             continue
-        m = api_call_entry_re.match(line)
-        if m:
-            (time, _, _, state, api) = m.groups()
-            entry = ("API", state, api) if not time_flag else ("API",
-                                                               float(time),
-                                                               state, api)
-            ret.append(entry)
+        (time, kind, _, state, payload) = tokens
+        if kind == "SYS":
+            entry = ("SYS", payload) if not time_flag else ("SYS",
+                                                            float(time),
+                                                            payload)
+        else:
+            entry = ("API", state, payload) if not time_flag else ("API",
+                                                                   float(time),
+                                                                   state,
+                                                                   payload)
+        ret.append(entry)
 
     assert len(ret) == len(trace)
     return ret
 
-def load_trace(path, threads=True, time=False):
+## Sidecar index of a trace file: the byte ranges of the lines of each
+## thread, as a flat array of (start, end) offsets. Contiguous lines of
+## the same thread share a range. The size and mtime of the trace file are
+## stored with it, so a stale index is rebuilt, as well as an index of an
+## older version.
+trace_index_suffix = '.tidx'
+trace_index_version = 2
+trace_entry_bytes_re = re.compile(rb"^[\d\.]+\s[A-Z]+\s(\d{1,6})\s")
+
+def _trace_stamp(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+def build_trace_index(path):
+    threads = {}
+    offset = 0
+    last = None
+    with open(path, 'rb') as fp:
+        for line in fp:
+            m = trace_entry_bytes_re.match(line)
+            if m:
+                t = int(m.groups()[0])
+                if t == last:
+                    threads[t][-1] = offset + len(line)
+                else:
+                    if t not in threads:
+                        threads[t] = array('Q')
+                    threads[t].extend((offset, offset + len(line)))
+                last = t
+            else:
+                ## A range can't cover the lines that are not trace entries
+                last = None
+            offset += len(line)
+    return {'version': trace_index_version, 'stamp': _trace_stamp(path),
+            'threads': threads}
+
+def load_trace_index(path):
+    index_file = str(path) + trace_index_suffix
+    if Path(index_file).is_file():
+        with open(index_file, 'rb') as pf:
+            index = pickle.load(pf)
+        if (index.get('version') == trace_index_version
+            and index['stamp'] == _trace_stamp(path)):
+            return index
+    index = build_trace_index(path)
+    try:
+        with open(index_file, 'wb') as pf:
+            pickle.dump(index, pf)
+    except OSError:
+        print("Cannot write trace index %s" % index_file, file=sys.stderr)
+    return index
+
+def trace_threads(path):
+    if is_binary_trace(path):
+        return binary_trace_threads(path)
+    if Path(path).suffix in compressed_openers:
+        return list(load_trace(path).keys())
+    return list(load_trace_index(path)['threads'].keys())
+
+## Lines of a single thread, read through the index
+def read_thread_lines(path, tid):
+    ranges = load_trace_index(path)['threads'][tid]
+    lines = []
+    with open(path, 'rb') as fp, \
+         mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        for i in range(0, len(ranges), 2):
+            chunk = io.BytesIO(m[ranges[i]:ranges[i+1]])
+            lines += [line.decode() for line in chunk]
+    return lines
+
+## With tid, only the lines of that thread are parsed. Compressed traces
+## can't be memory mapped, so they are read in full. Binary traces
+## (convert_trace.py) are decoded instead of parsed. If the trace cache is
+## enabled (see trace_cache.py), text traces are parsed once and then
+## loaded from the cache, unless cache is False
+def load_trace(path, threads=True, time=False, tid=None, cache=True):
     if not Path(path).is_file():
         print("%s is not a valid file" % path, file=sys.stderr)
         return
-    with open(path, "r") as fp:
+    if is_binary_trace(path):
+        return load_binary_trace(path, threads, time, tid)
+    if cache and trace_cache.trace_cache_dir is not None:
+        return trace_cache.cached_trace(parse_trace, path, threads, time, tid)
+    return parse_trace(path, threads, time, tid)
+
+def parse_trace(path, threads=True, time=False, tid=None):
+    if tid is not None:
+        if Path(path).suffix in compressed_openers:
+            return parse_trace(path, True, time)[tid]
+        return parse_lines(read_thread_lines(path, tid), time)
+    with open_trace(path) as fp:
         trace = read_trace_file(fp, threads)
     if threads:
         return {tid: parse_lines(trace, time) for tid, trace in trace.items()}
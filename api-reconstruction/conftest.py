@@ -0,0 +1,2 @@
+## Puts api-reconstruction on sys.path, so the tests import analysis like
+## the scripts do
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import sys
+import pickle
+import argparse
+
+from pathlib import Path
+
+from analysis import load_kb, csr_from_kb, save_csr_kb
+from analysis import dedup_kb, dedup_kb_to_pickle, save_lazy_kb
+
+## Convert a KB (pickle file or KB store) to the columnar format, which
+## load_kb memory maps instead of unpickling, to a deduplicated KB, or to a
+## lazy KB whose APIs are only unpickled when accessed
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("kb", type=str)
+    parser.add_argument("output", type=str,
+                        help="output directory, or file with --dedup " +
+                        "and --lazy")
+    parser.add_argument("--dedup", action="store_true",
+                        help="keep the distinct argument-stripped " +
+                        "realizations of each API with their count")
+    parser.add_argument("--lazy", action="store_true",
+                        help="write a single file with one record per API")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    if not Path(args.kb).exists():
+        print("Error: No KB file found", file=sys.stderr)
+        sys.exit(1)
+
+    d, syscalls = load_kb(args.kb)
+    if args.dedup:
+        with open(args.output, "wb") as of:
+            pickle.dump(dedup_kb_to_pickle(dedup_kb(d)), of)
+            pickle.dump(syscalls, of)
+    elif args.lazy:
+        save_lazy_kb(d, syscalls, args.output)
+    else:
+        save_csr_kb(csr_from_kb(d), syscalls, args.output)
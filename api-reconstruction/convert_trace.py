@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+
+import sys
+
+from pathlib import Path
+
+from analysis import load_trace, trace_line_numbers, write_binary_trace
+
+## Convert a text trace (_strace_full log) to the binary trace format,
+## which load_trace reads without parsing
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: %s <trace> <binary trace>" % sys.argv[0])
+        sys.exit(1)
+
+    if not Path(sys.argv[1]).is_file():
+        print("%s: file not found" % sys.argv[1])
+        sys.exit(1)
+
+    write_binary_trace(load_trace(sys.argv[1], time=True),
+                       trace_line_numbers(sys.argv[1]), sys.argv[2])
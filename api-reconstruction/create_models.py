@@ -27,10 +27,9 @@ def create_models(cls):
     if not Path(kb_file).is_file():
         print("Error: No KB file found", file=sys.stderr)
         sys.exit(1)
-    with open(kb_file, "rb") as pf:
-        kb = pickle.load(pf)
+    (kb, syscalls) = load_kb(kb_file)
+    if 'signals' not in load_applied_filters(kb_file):
         kb = prune_kb_from_signals(kb)
-        syscalls = pickle.load(pf)
 
     with open(symbols_file, "rb") as pf:
         apis = pickle.load(pf)
@@ -45,7 +44,7 @@ def create_models(cls):
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
-        print("Usage: %s <models type>" % sys.argv[0], file=sys.stderr)
+        print("Usage: %s <models type> [kb]" % sys.argv[0], file=sys.stderr)
         sys.exit(1)
 
     model_class = sys.argv[1]
@@ -54,5 +53,9 @@ if __name__ == '__main__':
               file=sys.stderr)
         sys.exit(2)
 
+    ## A deduplicated KB (convert_kb.py --dedup) can replace the default one
+    if len(sys.argv) > 2:
+        kb_file = sys.argv[2]
+
     cls = eval(model_class)
     create_models(cls)
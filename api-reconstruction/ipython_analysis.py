@@ -38,33 +38,25 @@ def first_run():
         syscalls = pickle.load(pf)
 
     d = prune_kb_from_signals(d)
-    print("Finding leaf apis")
-    leaves = find_leaves(d)
-    print("Finding strong polymorph apis")
-    polymorph = find_polymorph(d)
-    print("Finding empty apis")
-    empties = find_empties(d)
-    print("Finding 0Sys apis")
-    no_sys = find_no_syscall_apis(d)
-    print("Finding 0IndSys apis")
-    no_ind_sys = find_no_indirect_sys(d)
+    print("Building the API call graph")
+    graph = APICallGraph(d)
+    print("Finding the API categories")
+    categories = kb_categories(d, graph)
+    save_measures(category_measures(categories))
     apis = set(d.keys())
-    print("Finding no-leaf apis")
-    no_leaves = apis - leaves
-    print("Finding weak monomorph apis")
-    monomorph = apis - polymorph
-    print("Finding 1+Sys apis")
-    sys = apis - no_sys
-    print("Finding 1+IndSys apis")
-    ind_sys = apis - no_ind_sys
-    print("Finding weak polymorph")
-    weak_polymorph = find_weak_polymorph(d)
+    leaves = category_apis(categories, 'leaf')
+    polymorph = category_apis(categories, 'polymorph')
+    empties = category_apis(categories, 'empty')
+    no_sys = apis - category_apis(categories, 'sys')
+    no_ind_sys = apis - category_apis(categories, 'ind_sys')
+    weak_polymorph = category_apis(categories, 'weak_polymorph')
     print("Finding strong monomorph apis")
     strong_monomorph = apis - weak_polymorph
     print("Building models for strong monomorph apis")
-    precise_models = build_precise_models(d, strong_monomorph)
+    precise_models = build_precise_models(d, strong_monomorph, graph)
     print("Building models for implicit monomorph apis")
-    implicit_precise_models = find_implicit_monomorph_models(d, precise_models)
+    implicit_precise_models = find_implicit_monomorph_models(d, precise_models,
+                                                             graph)
     print("Finding empty/non-empty models")
     empty_models = {api for api, model in implicit_precise_models.items()
                     if len(model) == 0}
@@ -83,8 +75,9 @@ def first_run():
     kb = prune_kb_from_empties(d, empty_models)
 
     with open('kb_no_empties.pickle', 'wb') as pf:
-        pickle.dump(kb, pf)
+        pickle.dump(kb_to_pickle(kb), pf)
         pickle.dump(syscalls, pf)
+    store_applied_filters('kb_no_empties.pickle', ['signals', 'empties'])
 
     with open(symbols_file, 'wb') as pf:
         pickle.dump(set(kb.keys()), pf)
@@ -106,15 +99,14 @@ def load_kb_no_empties():
     global models2
 
     print("Loading KB")
-    with open(kb_file, "rb") as pf:
-        sys.modules['classes'] = classes
-        kb= pickle.load(pf)
-        syscalls = pickle.load(pf)
+    sys.modules['classes'] = classes
+    kb, syscalls = load_kb(kb_file)
 
     print("Loading symbols")
     apis, syscalls = load_symbols(symbols_file)
 
-    kb = prune_kb_from_signals(kb)
+    if 'signals' not in load_applied_filters(kb_file):
+        kb = prune_kb_from_signals(kb)
     # print("Loading regexes")
     # f = open(regex_file, 'rb')
     # regexes_test = pickle.load(f)
@@ -5,7 +5,7 @@ from pathlib import Path
 
 from analysis import symbols_generator, find_leaves_models, get_syscall_name
 from analysis import prune_malloc_syscalls, list_remove_indexes, encode_trace
-from analysis import load_trace, parse_lines, remove_noise
+from analysis import load_trace, parse_lines, remove_noise, open_trace
 
 import analysis.classes as classes
 
@@ -132,5 +132,5 @@ if __name__ == '__main__':
         print("%s: file not found" % sys.argv[1])
         sys.exit(1)
 
-    with open(sys.argv[1], "r") as fp:
+    with open_trace(sys.argv[1]) as fp:
         main(fp)
@@ -8,11 +8,21 @@ import re
 import stat
 import sys
 import os
+import argparse
+from multiprocessing import Pool
 
 from functools import reduce
 from pathlib import Path
 
 from analysis import prune_malloc_syscalls, prune_signal_handlings, noisy_syscalls
+from analysis import load_kb, is_interned_kb, intern_realization
+from analysis import unintern_realization, name_table
+from analysis import is_partitioned_kb, iter_kb_partitions
+from analysis import load_partition_syscalls, save_partitioned_kb
+from analysis import kb_filter_chain, filter_kb, filter_realization
+from analysis import new_filter_stats, print_filter_stats, store_filter_stats
+from analysis import store_applied_filters, merge_filter_stats, DedupKB
+from analysis import kb_filter_factories, kb_to_pickle
 
 
 ## Declaring global objects
@@ -29,47 +39,209 @@ def get_api_list_from_trace(trace):
 
 def get_syscall_name(x): return x.split('(')[0]  # drop the paramenters
 
-def remove_noise(trace):
-    ret = []
-    tmp = trace
-    trace = prune_signal_handlings(prune_malloc_syscalls(trace))
-    del tmp
-    for entry in trace:
-        if entry[0] == 'SYS':
-            if get_syscall_name(entry[1]) in noisy_syscalls:
-                continue
-        ret.append(entry)
-    return ret
-
-def prune_kb(d):
-    new_kb = {}
-    apis = list(d.keys())
-    for api in apis:
+## Malloc arenas, signal handlings and noisy syscalls
+default_filters = ['malloc', 'signal_handlings', 'noisy']
+
+def remove_noise(trace, chain=None, stats=None):
+    if chain is None:
+        chain = kb_filter_chain(default_filters)
+    if stats is None:
+        stats = new_filter_stats(chain)
+    return filter_realization(chain, trace, stats)
+
+def prune_kb(d, chain=None, stats=None):
+    if chain is None:
+        chain = kb_filter_chain(default_filters)
+    return filter_kb(d, chain, stats, consume=True)
+
+## Prune an interned KB one API at a time, the pruned realizations are
+## interned again with the same name table
+def prune_interned_kb(ikb, chain=None, stats=None):
+    if chain is None:
+        chain = kb_filter_chain(default_filters)
+    if stats is None:
+        stats = new_filter_stats(chain)
+    table = name_table(ikb)
+    names = ikb['names']
+    kb = ikb['kb']
+    for api_id in list(kb.keys()):
+        kb[api_id] = [intern_realization(names,
+                          filter_realization(chain,
+                                             unintern_realization(table, r),
+                                             stats))
+                      for r in kb[api_id]]
+    return ikb
+
+## Parallel pruning. The KB is cut into slices of consecutive APIs of
+## about SLICE_EVENTS events, each worker gets the names of the filters and
+## one slice and returns the pruned slice with its stats. The slices are
+## merged back in order, so the KB is the same as the serial one.
+SLICE_EVENTS = 200000
+
+def kb_slices(d, unintern=None):
+    items = []
+    events = 0
+    for api in list(d.keys()):
         traces = d[api]
-        new_traces = []
-        for trace in traces:
-            new_traces.append(remove_noise(trace))
-        new_kb[api] = new_traces
-        del d[api]
-        del traces
+        if unintern is not None:
+            traces = [unintern(r) for r in traces]
+        items.append((api, traces))
+        events += sum(len(r) for r in traces)
+        ## Columnar KBs are read-only and memory mapped
+        if isinstance(d, dict):
+            del d[api]
+        if events >= SLICE_EVENTS:
+            yield items
+            items = []
+            events = 0
+    if len(items):
+        yield items
+
+def prune_slice(args):
+    (filters, items) = args
+    chain = kb_filter_chain(filters)
+    stats = new_filter_stats(chain)
+    return ([(api, [filter_realization(chain, r, stats) for r in traces])
+             for (api, traces) in items], stats)
+
+def prune_kb_parallel(d, filters, pool, stats, unintern=None):
+    if isinstance(d, DedupKB):
+        return filter_kb(d, kb_filter_chain(filters), stats)
+    new_kb = {}
+    ## imap keeps the input order
+    results = pool.imap(prune_slice, ((filters, items) for items in
+                                      kb_slices(d, unintern)))
+    for (items, slice_stats) in results:
+        new_kb.update(items)
+        merge_filter_stats(stats, slice_stats)
     return new_kb
 
+def prune_interned_kb_parallel(ikb, filters, pool, stats):
+    table = name_table(ikb)
+    names = ikb['names']
+    kb = prune_kb_parallel(ikb['kb'], filters, pool, stats,
+                           lambda r: unintern_realization(table, r))
+    for api_id, traces in kb.items():
+        ikb['kb'][api_id] = [intern_realization(names, r) for r in traces]
+    return ikb
+
+## Make equal events and API names the same object, so they are pickled
+## once. The realizations pruned by the workers don't share objects across
+## slices, and in a loaded KB the API names are shared between the keys and
+## the events. Once shared the pickled KB is the same as the serial one.
+def share_kb_events(kb):
+    events = {}
+    shared_kb = {}
+    for api, traces in kb.items():
+        shared = []
+        for r in traces:
+            new_r = []
+            for call in r:
+                if call not in events:
+                    events[call] = tuple(sys.intern(x) if isinstance(x, str)
+                                         else x for x in call)
+                new_r.append(events[call])
+            shared.append(new_r)
+        shared_kb[sys.intern(api)] = shared
+    return shared_kb
+
+def pickle_kb(kb, syscalls):
+    return pickle.dumps(kb_to_pickle(kb)) + pickle.dumps(syscalls)
+
+## Prune the KB again serially and compare the pickles byte for byte
+def check_parallel_prune(kb_file, kb, syscalls, filters):
+    d, _ = load_kb(kb_file, unintern=False)
+    chain = kb_filter_chain(filters)
+    stats = new_filter_stats(chain)
+    if is_interned_kb(d):
+        serial_kb = prune_interned_kb(d, chain, stats)
+    elif isinstance(d, DedupKB):
+        serial_kb = prune_kb(d, chain, stats)
+    else:
+        serial_kb = share_kb_events(prune_kb(d, chain, stats))
+    if pickle_kb(serial_kb, syscalls) != pickle_kb(kb, syscalls):
+        print("Error: the parallel and the serial pruned KBs differ",
+              file=sys.stderr)
+        sys.exit(1)
+    print("The parallel and the serial pruned KBs are the same")
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    ## Either db.pickle or a KB store directory (read_full_log.py --store)
+    parser.add_argument("kb", type=str, nargs="?", default="db.pickle")
+    parser.add_argument("--filters", type=str,
+                        default=','.join(default_filters),
+                        help="comma separated filters to apply, in order")
+    parser.add_argument("--stats", type=str, default=None,
+                        help="write the per-filter removal counts here")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of worker processes")
+    parser.add_argument("--check", action="store_true",
+                        help="with --jobs, prune the KB serially too and " +
+                        "check that the two pruned KBs are the same")
+    args = parser.parse_args()
+    ## The filters built from the KB (e.g. empties) are for remove_empties.py
+    for name in args.filters.split(','):
+        if name in kb_filter_factories:
+            parser.error("filter %s needs the KB, it can only be used by " %
+                         name + "remove_empties.py")
+    return args
+
 if __name__ == '__main__':
-    kb_file = "db.pickle"
+    args = parse_arguments()
+    kb_file = args.kb
     new_kb_file = 'pruned_db.pickle'
-
-    if not Path(kb_file).is_file():
+    filters = args.filters.split(',')
+    chain = kb_filter_chain(filters)
+    stats = new_filter_stats(chain)
+    ## One pool for all the partitions
+    pool = Pool(args.jobs) if args.jobs > 1 else None
+    if pool is not None:
+        prune = lambda d: prune_kb_parallel(d, filters, pool, stats)
+        prune_interned = lambda d: prune_interned_kb_parallel(d, filters,
+                                                              pool, stats)
+    else:
+        prune = lambda d: prune_kb(d, chain, stats)
+        prune_interned = lambda d: prune_interned_kb(d, chain, stats)
+
+    if not Path(kb_file).exists():
         print("Error: No KB file found", file=sys.stderr)
         sys.exit(1)
 
-    with open(kb_file, "rb") as pf:
-        d = pickle.load(pf)
-        syscalls = pickle.load(pf)
-
-    kb = prune_kb(d)
+    ## A partitioned KB (read_full_log.py --partitions) is pruned one
+    ## partition at a time into the pruned_db directory
+    if is_partitioned_kb(kb_file):
+        save_partitioned_kb('pruned_db',
+                            (share_kb_events(prune(d))
+                             for d in iter_kb_partitions(kb_file)),
+                            load_partition_syscalls(kb_file)[0])
+        store_applied_filters('pruned_db', filters)
+        if pool is not None:
+            pool.close()
+        print_filter_stats(stats)
+        if args.stats is not None:
+            store_filter_stats(stats, args.stats)
+        sys.exit(0)
+
+    d, syscalls = load_kb(kb_file, unintern=False)
+
+    if is_interned_kb(d):
+        kb = prune_interned(d)
+    elif isinstance(d, DedupKB):
+        kb = prune(d)
+    else:
+        kb = share_kb_events(prune(d))
     del d
+    if pool is not None:
+        pool.close()
+        if args.check:
+            check_parallel_prune(kb_file, kb, syscalls, filters)
 
     with open(new_kb_file, "wb") as of:
-        pickle.dump(kb, of)
+        pickle.dump(kb_to_pickle(kb), of)
         pickle.dump(syscalls, of)
+    store_applied_filters(new_kb_file, filters)
+    print_filter_stats(stats)
+    if args.stats is not None:
+        store_filter_stats(stats, args.stats)
 
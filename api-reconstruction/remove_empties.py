@@ -1,37 +1,59 @@
 #!/usr/bin/env python3
+import argparse
 from analysis import *
 
-def prune():
+## The signal lines are removed here once, instead of every time the KB is
+## loaded to build the models
+default_filters = ['empties', 'hanging', 'signals']
+
+def prune(kb_file, filters=default_filters, stats_file=None):
     kb = {}
     apis = {}
     syscalls = {}
-    kb_file = "pruned_db.pickle"
     kb_new_file = 'kb_no_empties.pickle'
 
-    if not Path(kb_file).is_file():
+    if not Path(kb_file).exists():
         print("Error: No KB file found", file=sys.stderr)
         sys.exit(1)
-    with open(kb_file, "rb") as pf:
-        d = pickle.load(pf)
-        syscalls = pickle.load(pf)
+    (d, syscalls) = load_kb(kb_file)
 
+    print("Building the API call graph")
+    graph = APICallGraph(d)
     print("Finding weak polymorph")
-    weak_polymorph = find_weak_polymorph(d)
+    weak_polymorph = find_weak_polymorph(d, graph)
     print("Finding strong monomorph apis")
     strong_monomorph = apis.keys() - weak_polymorph
     print("Building models for strong monomorph apis")
-    precise_models = build_precise_models(d, strong_monomorph)
+    precise_models = build_precise_models(d, strong_monomorph, graph)
     print("Building models for implicit monomorph apis")
-    implicit_precise_models = find_implicit_monomorph_models(d, precise_models)
+    implicit_precise_models = find_implicit_monomorph_models(d, precise_models,
+                                                             graph)
     print("Finding empty/non-empty models")
     empty_models = {api for api, model in implicit_precise_models.items()
                     if len(model) == 0}
 
-    kb = prune_kb_from_empties(d, empty_models)
-    kb_remove_hanging_calls(kb)
+    chain = kb_filter_chain(filters, empties=empty_models, kb=d)
+    stats = new_filter_stats(chain)
+    kb = filter_kb(d, chain, stats, consume=True)
     with open(kb_new_file, 'wb') as pf:
-        pickle.dump(kb, pf)
+        pickle.dump(kb_to_pickle(kb), pf)
         pickle.dump(syscalls, pf)
+    store_applied_filters(kb_new_file, filters)
+    print_filter_stats(stats)
+    if stats_file is not None:
+        store_filter_stats(stats, stats_file)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    ## pruned_db.pickle, or the pruned_db directory of a partitioned KB
+    parser.add_argument("kb", type=str, nargs="?", default="pruned_db.pickle")
+    parser.add_argument("--filters", type=str,
+                        default=','.join(default_filters),
+                        help="comma separated filters to apply, in order")
+    parser.add_argument("--stats", type=str, default=None,
+                        help="write the per-filter removal counts here")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    prune()
+    args = parse_arguments()
+    prune(args.kb, args.filters.split(','), args.stats)
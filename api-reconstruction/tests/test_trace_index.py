@@ -0,0 +1,38 @@
+from analysis.utils import load_trace, load_trace_index
+
+## Lines of thread 12 separated by lines that are not trace entries
+trace_lines = [
+    "1.000001 SYSCALL 12 openat(AT_FDCWD, \"/data\", O_RDONLY) = 3\n",
+    "1.000002 JAVA 12 S android.app.Activity.onCreate(android.os.Bundle)\n",
+    "garbage\n",
+    "1.000003 SYSCALL 12 read(3, \"\", 4096) = 0\n",
+    "  <... read resumed> ) = 0\n",
+    "\n",
+    "1.000004 JAVA 12 E android.app.Activity.onCreate(android.os.Bundle)\n",
+    "1.000005 SYSCALL 34 close(3) = 0\n",
+    "garbage\n",
+    "1.000006 SYSCALL 12 close(3) = 0\n",
+]
+
+def write_trace(tmp_path):
+    path = tmp_path / 'app_strace_full'
+    path.write_text(''.join(trace_lines))
+    return str(path)
+
+def test_thread_ranges_skip_lines_that_are_not_entries(tmp_path):
+    path = write_trace(tmp_path)
+    data = open(path, 'rb').read()
+    ranges = load_trace_index(path)['threads'][12]
+    lines = b''.join(data[ranges[i]:ranges[i+1]]
+                     for i in range(0, len(ranges), 2))
+    assert b'garbage' not in lines
+    assert b'resumed' not in lines
+    assert len(lines.splitlines()) == 5
+
+def test_thread_load_matches_full_load(tmp_path):
+    path = write_trace(tmp_path)
+    for time in (False, True):
+        threads = load_trace(path, time=time, cache=False)
+        for tid in (12, 34):
+            assert load_trace(path, tid=tid, time=time,
+                              cache=False) == threads[tid]
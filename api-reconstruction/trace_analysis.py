@@ -97,7 +97,7 @@ class my_bool:
 
 @persist("api_cov", (0, 1))
 def compute_coverage(app_name, thread):
-    trace = load_trace(app_name)[thread]
+    trace = load_trace(app_name, tid=thread)
     span = trace_api_span(trace)
     a = my_bool()
     values = sorted({x: 1 if not a else 0
@@ -130,7 +130,7 @@ def bar_plot(app_name, thread):
 
 @lru_cache(maxsize=100)
 def hit_miss(trace, thread):
-    trr = load_trace(trace)[thread]
+    trr = load_trace(trace, tid=thread)
     trr = trace_trim_syscalls(trr)
     apis = trace_get_apis(trr)
     first = trace_first_api(trr)
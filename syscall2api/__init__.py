@@ -0,0 +1,5 @@
+from .interned import *
+from .syscall_index import *
+from .kb_store import *
+from .tokenizer import *
+from .partitions import *
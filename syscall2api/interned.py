@@ -0,0 +1,64 @@
+from array import array
+
+## Interned KB: every API and syscall string is stored once in a name
+## table ({name: ID}, IDs in insertion order) and each realization is an
+## array of event IDs, (name ID << 1) | 1 for APIs and name ID << 1 for
+## syscalls. The KB maps the name ID of each API to its realizations.
+## Only builtin types are pickled, so the KB can be loaded without this
+## package.
+INTERNED_FORMAT = "interned"
+EVENT_TYPECODE = "I"
+
+def is_interned_kb(db):
+    return isinstance(db, dict) and db.get("__kb_format__") == INTERNED_FORMAT
+
+def new_interned_kb():
+    return {"__kb_format__": INTERNED_FORMAT, "names": {}, "kb": {}}
+
+def name_table(ikb):
+    return list(ikb["names"])
+
+def intern_name(names, name):
+    return names.setdefault(name, len(names))
+
+def intern_realization(names, trace):
+    return array(EVENT_TYPECODE,
+                 [(intern_name(names, name) << 1) | (type == "API")
+                  for (type, name) in trace])
+
+def unintern_realization(table, realization):
+    return [("API" if event & 1 else "SYS", table[event >> 1])
+            for event in realization]
+
+## Same as merge_api_traces, for an interned KB
+def merge_interned_api_traces(ikb, dicts):
+    names = ikb["names"]
+    kb = ikb["kb"]
+    for trace in dicts:
+        for api in trace.keys():
+            api_id = intern_name(names, api)
+            if api_id not in kb:
+                kb[api_id] = []
+            for entry in trace[api]:
+                kb[api_id].append(intern_realization(names, entry))
+    return ikb
+
+def intern_kb(db):
+    return merge_interned_api_traces(new_interned_kb(), [db])
+
+## Yield (api, realizations) one API at a time, decoding only that API
+def iter_interned_kb(ikb, table=None):
+    if table is None:
+        table = name_table(ikb)
+    for api_id, traces in ikb["kb"].items():
+        yield (table[api_id],
+               [unintern_realization(table, r) for r in traces])
+
+def interned_realizations(ikb, api, table=None):
+    if table is None:
+        table = name_table(ikb)
+    return [unintern_realization(table, r)
+            for r in ikb["kb"][ikb["names"][api]]]
+
+def unintern_kb(ikb):
+    return dict(iter_interned_kb(ikb))
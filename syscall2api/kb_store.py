@@ -0,0 +1,78 @@
+import os
+import os.path
+import json
+import pickle
+
+from .interned import is_interned_kb, unintern_kb
+from .syscall_index import build_syscall_index, merge_syscall_index
+
+## Append-only KB store: a directory of shards, each one pickled like
+## db.pickle (db, then syscalls), plus a manifest listing the shards in
+## ingestion order and the content hash of the trace files they contain.
+## The syscall index of a shard, if any, is pickled after the syscalls.
+## The shards are written by trace-parser/read_full_log.py --store.
+manifest_filename = "manifest.json"
+
+def load_manifest(store):
+    path = os.path.join(store, manifest_filename)
+    if not os.path.isfile(path):
+        return {"shards": [], "ingested": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def iter_shards(store):
+    for shard in load_manifest(store)["shards"]:
+        with open(os.path.join(store, shard["file"]), "rb") as dbf:
+            (db, syscalls) = (pickle.load(dbf), pickle.load(dbf))
+        if is_interned_kb(db):
+            db = unintern_kb(db)
+        yield (db, syscalls)
+
+## Append the APIs of a shard to the syscall lists, keeping the order in
+## which update_syscalls would have found them
+def merge_syscalls(syscalls, shard_syscalls):
+    for syscall_name, apis in shard_syscalls.items():
+        if syscall_name not in syscalls:
+            syscalls[syscall_name] = list(apis)
+            continue
+        known = set(syscalls[syscall_name])
+        for api in apis:
+            if api not in known:
+                syscalls[syscall_name].append(api)
+                known.add(api)
+    return syscalls
+
+## Associative reduce of two (db, syscalls) KB shards. Merging the shards
+## in ingestion order gives the same KB as a sequential ingest.
+def merge_db_shards(kb, shard):
+    (db, syscalls) = kb[:2]
+    for api, realizations in shard[0].items():
+        if api not in db:
+            db[api] = []
+        db[api] += realizations
+    merge_syscalls(syscalls, shard[1])
+    return kb
+
+## Union of the syscall indexes of the shards. Shards written without
+## one are indexed when they are read, on the syscalls of the shard unless
+## syscall_names is given
+def load_store_syscall_index(store, syscall_names=None):
+    index = {}
+    for shard in load_manifest(store)["shards"]:
+        with open(os.path.join(store, shard["file"]), "rb") as dbf:
+            db = pickle.load(dbf)
+            shard_syscalls = pickle.load(dbf)
+            try:
+                shard_index = pickle.load(dbf)
+            except EOFError:
+                shard_index = build_syscall_index(
+                    db, shard_syscalls.keys() if syscall_names is None
+                    else syscall_names)
+        merge_syscall_index(index, shard_index)
+    return index
+
+def load_sharded_db(store):
+    kb = (dict(), dict())
+    for shard in iter_shards(store):
+        merge_db_shards(kb, shard)
+    return kb
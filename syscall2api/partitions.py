@@ -0,0 +1,91 @@
+import os
+import os.path
+import json
+import pickle
+
+## Partitioned KB, written by trace-parser/read_full_log.py --partitions.
+## APIs are hashed into N partitions. Realizations are appended to the
+## chunk file of their partition (part_NNNN.chunks) as pickled
+## {api: [realization]} chunks, and finalizing a partition merges its
+## chunks into a single {api: [realization]} pickle (part_NNNN.kb) and
+## removes them. The KB file also records how much of the chunk file it
+## contains, which is only non-zero for partitions finalized before the
+## chunks were removed. A finalization moves the chunk file aside
+## (part_NNNN.chunks.merging) and writes the new KB to part_NNNN.kb.tmp
+## before it removes the merged chunks, see finalize_partition.
+## The syscall lists and the syscall index are small enough to be kept in
+## memory, they are stored in syscalls.pickle.
+partitions_filename = "partitions.json"
+partition_syscalls_filename = "syscalls.pickle"
+
+def is_partitioned_kb(path):
+    return os.path.isfile(os.path.join(path, partitions_filename))
+
+def load_partitions_info(path):
+    with open(os.path.join(path, partitions_filename), "r") as f:
+        return json.load(f)
+
+def partition_chunks_file(path, i):
+    return os.path.join(path, "part_%04d.chunks" % i)
+
+def partition_merging_file(path, i):
+    return os.path.join(path, "part_%04d.chunks.merging" % i)
+
+def partition_kb_file(path, i):
+    return os.path.join(path, "part_%04d.kb" % i)
+
+## (KB, offset in the chunk file) of a partition KB file
+def load_partition_kb_file(kb_file):
+    if not os.path.isfile(kb_file):
+        return dict(), 0
+    with open(kb_file, "rb") as f:
+        return pickle.load(f), pickle.load(f)
+
+def load_partition_chunks(kb, chunks_file, offset=0):
+    with open(chunks_file, "rb") as f:
+        f.seek(offset)
+        try:
+            while True:
+                for api, realizations in pickle.load(f).items():
+                    if api not in kb:
+                        kb[api] = []
+                    kb[api] += realizations
+        except EOFError:
+            pass
+    return kb
+
+## The KB of partition i, with the chunks that are not finalized yet,
+## without writing anything. The new KB file of an interrupted
+## finalization replaces the KB file once the merged chunks are removed.
+def load_kb_partition(path, i):
+    kb_file = partition_kb_file(path, i)
+    merging_file = partition_merging_file(path, i)
+    if os.path.isfile(kb_file + ".tmp") and not os.path.isfile(merging_file):
+        kb_file += ".tmp"
+    (kb, offset) = load_partition_kb_file(kb_file)
+    ## The offset is in the oldest of the chunk files
+    for chunks_file in (merging_file, partition_chunks_file(path, i)):
+        if os.path.isfile(chunks_file):
+            load_partition_chunks(kb, chunks_file, offset)
+            offset = 0
+    return kb
+
+## The KB of each partition, one at a time
+def iter_kb_partitions(path):
+    for i in range(load_partitions_info(path)["partitions"]):
+        yield load_kb_partition(path, i)
+
+## (syscalls, syscall index) of a partitioned KB, the index is None if it
+## wasn't stored
+def load_partition_syscalls(path):
+    filename = os.path.join(path, partition_syscalls_filename)
+    if not os.path.isfile(filename):
+        return dict(), None
+    with open(filename, "rb") as f:
+        return pickle.load(f), pickle.load(f)
+
+def load_partitioned_kb(path):
+    db = dict()
+    for kb in iter_kb_partitions(path):
+        db.update(kb)
+    return db, load_partition_syscalls(path)[0]
@@ -0,0 +1,94 @@
+import os
+import os.path
+import pickle
+from collections import Counter
+
+from .interned import is_interned_kb, unintern_realization
+
+## Inverted index from syscall names to the APIs whose realizations issue
+## them: {syscall name: Counter({api: occurrences})}. It has the same APIs
+## as the syscalls lists of the KB, with the number of times each API
+## issued each syscall. It is stored next to db.pickle.
+syscall_index_filename = "syscall_index.pickle"
+
+def get_syscall_name(syscall):
+    return syscall.split('(')[0]
+
+## Same as update_syscalls, the APIs are added to the syscall lists in the
+## order in which they are found. The index is used for the membership
+## tests and keeps the counts
+def update_syscall_index(index, syscalls, traces):
+    for api in traces:
+        for trace in traces[api]:
+            for (t, x) in trace:
+                if 'SYS' not in t:
+                    continue
+                syscall_name = get_syscall_name(x)
+                if syscall_name not in syscalls:
+                    continue
+                counts = index.get(syscall_name)
+                if counts is None:
+                    counts = Counter({a: 0 for a in syscalls[syscall_name]})
+                    index[syscall_name] = counts
+                if api not in counts:
+                    syscalls[syscall_name].append(api)
+                counts[api] += 1
+    return index
+
+def build_syscall_index(db, syscall_names):
+    index = {}
+    syscalls = {x: list() for x in syscall_names}
+    if is_interned_kb(db):
+        table = list(db["names"])
+        for api_id, traces in db["kb"].items():
+            traces = [unintern_realization(table, r) for r in traces]
+            update_syscall_index(index, syscalls, {table[api_id]: traces})
+    else:
+        update_syscall_index(index, syscalls, db)
+    return index
+
+def merge_syscall_index(index, other):
+    for syscall, counts in other.items():
+        if syscall not in index:
+            index[syscall] = Counter()
+        index[syscall].update(counts)
+    return index
+
+## The index is pickled with the size and mtime of the KB file it
+## belongs to. An index that doesn't match the KB (e.g. left over from a
+## deleted or regenerated db.pickle) isn't loaded, the caller rebuilds it
+## with build_syscall_index.
+def kb_stamp(kb_file):
+    if not os.path.isfile(kb_file):
+        return None
+    st = os.stat(kb_file)
+    return [st.st_size, st.st_mtime_ns]
+
+def load_syscall_index(filename=syscall_index_filename, kb_file=None):
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, "rb") as f:
+        index = pickle.load(f)
+        if kb_file is None:
+            return index
+        try:
+            stamp = pickle.load(f)
+        except EOFError:
+            return None
+    if stamp != kb_stamp(kb_file):
+        return None
+    return index
+
+def store_syscall_index(index, filename=syscall_index_filename, kb_file=None):
+    with open(filename + ".tmp", "wb") as f:
+        pickle.dump(index, f)
+        if kb_file is not None:
+            pickle.dump(kb_stamp(kb_file), f)
+    os.replace(filename + ".tmp", filename)
+
+def apis_for_syscall(index, syscall):
+    return {api for api, count in index.get(syscall, Counter()).items()
+            if count > 0}
+
+def top_apis_for_syscall(index, syscall, n=10):
+    return index.get(syscall, Counter()).most_common(n)
@@ -0,0 +1,89 @@
+import re
+
+## Line tokenizer shared by the trace parsers and the analysis scripts.
+## Full log lines are classified by their fixed fields (timestamp, kind,
+## tid, S/E) with split. Raw strace lines only go through the API regex if
+## they contain a write(). Lines that don't have the canonical layout, or
+## that could be read in more than one way by the regexes (e.g. a syscall
+## payload containing "JAVA"), go through the original regexes, so the
+## result is always the same as matching the regexes one after another.
+## Both tokenizers return (timestamp, kind, tid, state, payload), where
+## kind is "API" or "SYS" and state is None for syscalls, or None if the
+## line is neither an API call nor a syscall.
+
+## Full log lines, as written by parse_complete_syscall_log.py
+full_api_entry_re = re.compile(r"^(.*)(ANDROID|JAVA)\s(\d{1,6})\s(S|E)\s(.*)$")
+full_syscall_entry_re = re.compile(r"^(.*)SYSCALL\s([\d]{1,6})\s(.*)$")
+
+## Raw strace lines
+strace_api_entry_re = re.compile(r"^([0-9]{1,6})\s+([0-9]+.[0-9]+)\s+write\(\d+<\/dev\/null>,\s+\"(S|E) ([^\"]+)\".*")
+strace_syscall_entry_re = re.compile(r"^([0-9]{1,6})[ ]+([0-9]+.[0-9]+)[ ](.*)$")
+
+def _is_tid(s):
+    return 0 < len(s) <= 6 and s.isdecimal()
+
+## The regexes stop at the first newline, so only the trailing one is
+## allowed in the payload of a line
+def _payload(s):
+    if s.endswith("\n"):
+        s = s[:-1]
+    return s if "\n" not in s else None
+
+## syscall_first gives precedence to the syscall regex for lines that
+## match both regexes, as analysis.utils.parse_lines does
+def tokenize_full_line_regex(line, syscall_first=False):
+    regexes = [full_api_entry_re, full_syscall_entry_re]
+    if syscall_first:
+        regexes.reverse()
+    for regex in regexes:
+        match = regex.match(line)
+        if match is None:
+            continue
+        if regex is full_api_entry_re:
+            (timestamp, _, tid, state, api) = match.groups()
+            return (timestamp, "API", tid, state, api)
+        (timestamp, tid, syscall) = match.groups()
+        return (timestamp, "SYS", tid, None, syscall)
+    return None
+
+def tokenize_full_line(line, syscall_first=False):
+    fields = line.split(' ', 3)
+    if len(fields) == 4 and _is_tid(fields[2]):
+        (timestamp, kind, tid, rest) = fields
+        ## The regexes keep the separator at the end of the timestamp
+        timestamp += ' '
+        keywords = line.count("JAVA") + line.count("ANDROID")
+        if kind == "SYSCALL":
+            payload = _payload(rest)
+            if (keywords == 0 and line.count("SYSCALL") == 1
+                and payload is not None):
+                return (timestamp, "SYS", tid, None, payload)
+        elif (kind in ("JAVA", "ANDROID") and keywords == 1
+              and "SYSCALL" not in line
+              and rest[:1] in ("S", "E") and rest[1:2] == " "):
+            payload = _payload(rest[2:])
+            if payload is not None:
+                return (timestamp, "API", tid, rest[0], payload)
+    return tokenize_full_line_regex(line, syscall_first)
+
+def tokenize_strace_line_regex(line):
+    match = strace_api_entry_re.match(line)
+    if match is not None:
+        (tid, timestamp, state, api) = match.groups()
+        return (timestamp, "API", tid, state, api)
+    match = strace_syscall_entry_re.match(line)
+    if match is not None:
+        (tid, timestamp, syscall) = match.groups()
+        return (timestamp, "SYS", tid, None, syscall)
+    return None
+
+## Only write() lines can be API call markers, every other line needs a
+## single match of the syscall regex
+def tokenize_strace_line(line):
+    if "write(" in line:
+        return tokenize_strace_line_regex(line)
+    match = strace_syscall_entry_re.match(line)
+    if match is None:
+        return None
+    (tid, timestamp, syscall) = match.groups()
+    return (timestamp, "SYS", tid, None, syscall)
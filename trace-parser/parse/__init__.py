@@ -1,2 +1,13 @@
 from .parse_internals import *
 from .parse_binder import *
+from .straighten import *
+from .syscall_log import *
+from .ingest import *
+from .kb_store import *
+from syscall2api.tokenizer import *
+from syscall2api.interned import *
+from .trace_io import *
+from syscall2api.syscall_index import *
+from .ingest_stats import *
+from .partitions import *
+from .reservoir import *
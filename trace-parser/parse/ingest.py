@@ -0,0 +1,37 @@
+import sys
+from collections import defaultdict
+
+from .straighten import straighten
+from .syscall_log import parse_syscall_line
+
+## Convert a full log event to the (type, state, payload, timestamp) entries
+## read_full_log.py builds from the _full lines. Syscalls keep the trailing
+## space that parse_line leaves at the end of the payload of _full lines.
+def event_to_entry(event):
+    (timestamp, kind, tid, payload, api) = event
+    if kind == "JAVA":
+        return ("API", payload, api, timestamp)
+    return ("SYS", None, payload + " ", timestamp)
+
+## Single pass from a raw strace file to the per-thread traces, without
+## writing the _straight and _full files: unfinished/resumed syscalls are
+## merged, every line is parsed once and each thread's events are sorted
+## the same way parse_complete_syscall_log.py sorts the full log.
+def read_strace_threads(strace_file):
+    threads_events = defaultdict(list)
+    for _, line in straighten(strace_file):
+        event = parse_syscall_line(line)
+        if event is None:
+            print("Syscall line ignored: %s" % line, file=sys.stderr)
+            continue
+        threads_events[event[2]].append(event)
+    strace_file.close()
+
+    for events in threads_events.values():
+        events.sort()
+
+    ## Threads are ordered by their first event, as in the full log
+    threads_traces = {}
+    for tid, events in sorted(threads_events.items(), key=lambda x: x[1][0]):
+        threads_traces[tid] = [event_to_entry(e) for e in events]
+    return threads_traces
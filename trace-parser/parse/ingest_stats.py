@@ -0,0 +1,72 @@
+import sys
+import json
+from collections import Counter
+
+## Ingest diagnostics, counted while the API stacks of the threads are
+## rebuilt instead of printed for every event:
+##   unwinds         API frames popped because their end was not found
+##   orphan_ends     API ends without a matching start in the stack
+##   stack_unwound   stacks unwound down to the bottom
+##   start_size      syscalls before the first API of a thread
+##   noapi_size      syscalls outside of any API
+## Counts are kept in total, per thread (app:tid) and per API. One message
+## out of every `sample` diagnostic events is kept for the verbose log.
+max_log_messages = 10000
+
+def new_ingest_stats(sample=0):
+    return {"totals": Counter(), "threads": {}, "apis": {}, "app": None,
+            "sample": sample, "events": 0, "log": []}
+
+def set_ingest_app(stats, app_name):
+    stats["app"] = app_name
+
+def _thread_key(stats, tid):
+    if stats["app"] is None:
+        return str(tid)
+    return "%s:%s" % (stats["app"], tid)
+
+def count_ingest(stats, key, tid, api=None, n=1):
+    stats["totals"][key] += n
+    thread = _thread_key(stats, tid)
+    if thread not in stats["threads"]:
+        stats["threads"][thread] = Counter()
+    stats["threads"][thread][key] += n
+    if api is not None:
+        if api not in stats["apis"]:
+            stats["apis"][api] = Counter()
+        stats["apis"][api][key] += n
+
+## Count a diagnostic event. The message is only formatted if sampled
+def ingest_event(stats, key, tid, api, message, *args):
+    count_ingest(stats, key, tid, api)
+    stats["events"] += 1
+    if (stats["sample"] > 0 and stats["events"] % stats["sample"] == 0
+        and len(stats["log"]) < max_log_messages):
+        stats["log"].append("%s %s: %s" % (_thread_key(stats, tid), key,
+                                           message % args))
+
+def merge_ingest_stats(stats, other):
+    stats["totals"].update(other["totals"])
+    for field in ("threads", "apis"):
+        for k, counts in other[field].items():
+            if k not in stats[field]:
+                stats[field][k] = Counter()
+            stats[field][k].update(counts)
+    stats["events"] += other["events"]
+    room = max_log_messages - len(stats["log"])
+    stats["log"] += other["log"][:max(room, 0)]
+    return stats
+
+def ingest_summary(stats):
+    return {"totals": stats["totals"], "threads": stats["threads"],
+            "apis": stats["apis"]}
+
+def store_ingest_stats(stats, filename, log_filename=None):
+    with open(filename, "w") as f:
+        json.dump(ingest_summary(stats), f, indent=1, sort_keys=True)
+    if log_filename is not None:
+        with open(log_filename, "w") as f:
+            for message in stats["log"]:
+                print(message, file=f)
+    print("Ingest stats: %s" % json.dumps(stats["totals"], sort_keys=True),
+          file=sys.stderr)
@@ -0,0 +1,63 @@
+import os
+import os.path
+import json
+import pickle
+import hashlib
+
+from syscall2api.interned import *
+from syscall2api.syscall_index import *
+from syscall2api.kb_store import *
+from .ingest_stats import *
+
+## Writer side of the KB store (see syscall2api/kb_store.py): new shards
+## are appended and the manifest records the content hash of the trace
+## files they contain.
+def trace_hash(path, block_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def store_manifest(store, manifest):
+    path = os.path.join(store, manifest_filename)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+## Append a shard built from the given {hash: trace path} files
+def append_shard(store, db, syscalls, traces, index=None):
+    os.makedirs(store, exist_ok=True)
+    manifest = load_manifest(store)
+    shard = "shard_%06d.pickle" % len(manifest["shards"])
+    with open(os.path.join(store, shard), "wb") as dbf:
+        pickle.dump(db, dbf)
+        pickle.dump(syscalls, dbf)
+        if index is not None:
+            pickle.dump(index, dbf)
+    manifest["shards"].append({"file": shard, "traces": traces})
+    for h, path in traces.items():
+        manifest["ingested"][h] = path
+    store_manifest(store, manifest)
+    return shard
+
+## Syscall index and ingest stats that come with the shards built by
+## read_full_log.py
+def merge_shard_extras(kb, shard):
+    if len(kb) > 2:
+        merge_syscall_index(kb[2], shard[2])
+    if len(kb) > 3:
+        merge_ingest_stats(kb[3], shard[3])
+
+## Same as merge_db_shards, with the extras of the shards
+def merge_kb_shards(kb, shard):
+    merge_db_shards(kb, shard)
+    merge_shard_extras(kb, shard)
+    return kb
+
+def merge_interned_kb_shards(kb, shard):
+    (ikb, syscalls) = kb[:2]
+    merge_interned_api_traces(ikb, [shard[0]])
+    merge_syscalls(syscalls, shard[1])
+    merge_shard_extras(kb, shard)
+    return kb
@@ -2,9 +2,8 @@ import sys
 import os
 import re
 import pickle
+from syscall2api.tokenizer import tokenize_full_line
 
-api_call_entry_re = re.compile(r"^(.*)(ANDROID|JAVA)\s(\d{1,6})\s(S|E)\s(.*)$")
-syscall_entry_re = re.compile(r"^(.*)SYSCALL\s([\d]{1,6})\s(.*)$")
 db_filename = "db.pickle"
 syscalls_list_filename = "syscall_list"
 
@@ -27,19 +26,14 @@ def read_syscall_list():
         return [x.strip() for x in ret]
 
 def parse_line(line):
-    match = api_call_entry_re.match(line)
-    if match is not None:
-        (timestamp,_, tid, state, api) = match.groups()
-        return (tid, "API", state, api, timestamp)
-    else:
-        match = syscall_entry_re.match(line)
-        if match is None:
-            print("Something went terribly wrong", file=sys.stderr)
-            print("Line %s doesn't contain either a syscall nor an API call" %
-                  line, file=sys.stderr)
-            return (None, None, None, None)
-        (timestamp, tid, syscall) = match.groups()
-        return (tid, "SYS", None, syscall, timestamp)
+    tokens = tokenize_full_line(line)
+    if tokens is None:
+        print("Something went terribly wrong", file=sys.stderr)
+        print("Line %s doesn't contain either a syscall nor an API call" %
+              line, file=sys.stderr)
+        return (None, None, None, None)
+    (timestamp, type, tid, state, payload) = tokens
+    return (tid, type, state, payload, timestamp)
 
 def parse_line_convert(line):
     ret = parse_line(line)
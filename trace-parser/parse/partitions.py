@@ -0,0 +1,126 @@
+import os
+import os.path
+import json
+import pickle
+import zlib
+from multiprocessing import Pool
+
+from syscall2api.partitions import *
+from .kb_store import *
+
+## Writer side of the partitioned KB (see syscall2api/partitions.py), for
+## corpora whose KB doesn't fit in memory. Realizations are buffered and
+## appended to the chunk files whenever more than buffer_events events are
+## buffered, and the partitions are finalized once they are all written.
+BUFFER_EVENTS = 1000000
+
+def api_partition(api, n):
+    return zlib.crc32(api.encode()) % n
+
+def _store_atomic(filename, *objs):
+    with open(filename + ".tmp", "wb") as f:
+        for obj in objs:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + ".tmp", filename)
+
+class KBPartitions(object):
+    def __init__(self, path, n=64, buffer_events=BUFFER_EVENTS):
+        os.makedirs(path, exist_ok=True)
+        if is_partitioned_kb(path):
+            n = load_partitions_info(path)["partitions"]
+        else:
+            with open(os.path.join(path, partitions_filename), "w") as f:
+                json.dump({"partitions": n}, f)
+        self.path = path
+        self.n = n
+        self.buffer_events = buffer_events
+        self.buffers = [dict() for _ in range(n)]
+        self.buffered = 0
+
+    ## Same as merge_api_traces
+    def merge_api_traces(self, dicts):
+        for trace in dicts:
+            for api, entries in trace.items():
+                buf = self.buffers[api_partition(api, self.n)]
+                if api not in buf:
+                    buf[api] = []
+                buf[api] += entries
+                self.buffered += sum(len(e) for e in entries) + len(entries)
+                if self.buffered >= self.buffer_events:
+                    self.flush()
+        return self
+
+    def flush(self):
+        for i, buf in enumerate(self.buffers):
+            if len(buf) == 0:
+                continue
+            with open(partition_chunks_file(self.path, i), "ab") as f:
+                pickle.dump(buf, f, pickle.HIGHEST_PROTOCOL)
+            self.buffers[i] = dict()
+        self.buffered = 0
+
+    def close(self, syscalls, index):
+        self.flush()
+        _store_atomic(os.path.join(self.path, partition_syscalls_filename),
+                      syscalls, index)
+
+## Reduce step of the parallel ingest into partitions, like merge_kb_shards
+def merge_partitioned_kb_shards(kb, shard):
+    kb[0].merge_api_traces([shard[0]])
+    merge_syscalls(kb[1], shard[1])
+    merge_shard_extras(kb, shard)
+    return kb
+
+## Merge the new chunks of partition i into its KB file and return the KB.
+## The chunk file is moved aside before it is read, so chunks appended
+## later go to a new file. The new KB is written to a temporary file, then
+## the merged chunks are removed and the temporary file replaces the KB
+## file. If this is interrupted, the next call redoes the merge if the
+## merged chunks are still there, or else finishes replacing the KB file.
+def finalize_partition(path, i):
+    kb_file = partition_kb_file(path, i)
+    tmp_file = kb_file + ".tmp"
+    merging_file = partition_merging_file(path, i)
+    if os.path.isfile(tmp_file):
+        if os.path.isfile(merging_file):
+            os.remove(tmp_file)
+        else:
+            os.replace(tmp_file, kb_file)
+
+    (kb, offset) = load_partition_kb_file(kb_file)
+
+    ## Chunks left by an interrupted call are merged before the new ones
+    chunks_file = partition_chunks_file(path, i)
+    while True:
+        if not os.path.isfile(merging_file):
+            if not os.path.isfile(chunks_file):
+                return kb
+            os.replace(chunks_file, merging_file)
+        load_partition_chunks(kb, merging_file, offset)
+        with open(tmp_file, "wb") as f:
+            pickle.dump(kb, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(0, f, pickle.HIGHEST_PROTOCOL)
+        os.remove(merging_file)
+        os.replace(tmp_file, kb_file)
+        offset = 0
+
+def finalize_partition_star(args):
+    finalize_partition(*args)
+    return args[1]
+
+## Partitions are independent, so they can be finalized in parallel
+def finalize_partitions(path, jobs=1):
+    args = [(path, i) for i in range(load_partitions_info(path)["partitions"])]
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            for _ in pool.imap_unordered(finalize_partition_star, args):
+                pass
+    else:
+        for arg in args:
+            finalize_partition_star(arg)
+
+def build_partitions_syscall_index(path, syscall_names):
+    index = {}
+    for kb in iter_kb_partitions(path):
+        merge_syscall_index(index, build_syscall_index(kb, syscall_names))
+    return index
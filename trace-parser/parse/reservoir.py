@@ -0,0 +1,94 @@
+import os
+import os.path
+import pickle
+import hashlib
+
+from .kb_store import merge_syscalls, merge_shard_extras
+from syscall2api.syscall_index import kb_stamp
+
+## Per-API reservoir sampling: the KB keeps a uniform sample of at most k
+## realizations of each API (algorithm R) and the exact number of
+## realizations found. The random slot of the n-th realization of an API
+## is drawn from a hash of (seed, api, n), so the sample of an API only
+## depends on the sequence of its realizations: an incremental or a
+## parallel ingest gives the same sample as a single sequential one.
+## The syscall lists and the syscall index are updated before sampling, so
+## they are exact. The counts are stored next to db.pickle:
+## {"k": k, "seed": seed, "counts": {api: realizations}}, with the stamp of
+## the KB file they belong to (see kb_stamp), so the counts of a deleted or
+## regenerated db.pickle aren't used.
+reservoir_filename = "reservoir.pickle"
+
+def new_reservoir(k, seed=0):
+    return {"k": k, "seed": seed, "counts": {}}
+
+def load_reservoir(filename=reservoir_filename, kb_file=None):
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, "rb") as f:
+        reservoir = pickle.load(f)
+    if kb_file is not None and reservoir.get("stamp") != kb_stamp(kb_file):
+        return None
+    return reservoir
+
+def store_reservoir(reservoir, filename=reservoir_filename, kb_file=None):
+    if kb_file is not None:
+        reservoir["stamp"] = kb_stamp(kb_file)
+    with open(filename + ".tmp", "wb") as f:
+        pickle.dump(reservoir, f)
+    os.replace(filename + ".tmp", filename)
+
+## Uniform integer in [0, n)
+def reservoir_slot(seed, api, n):
+    h = hashlib.blake2b(("%d\0%s\0%d" % (seed, api, n)).encode(),
+                        digest_size=8)
+    return int.from_bytes(h.digest(), "little") % n
+
+## KB whose realizations are sampled as they are merged
+class SampledKB(dict):
+    def __init__(self, db, reservoir):
+        super().__init__()
+        self.reservoir = reservoir
+        counts = reservoir["counts"]
+        for api, realizations in db.items():
+            if api in counts:
+                self[api] = realizations
+                continue
+            ## Realizations ingested without sampling
+            self.add(api, realizations)
+
+    def add(self, api, realizations):
+        k = self.reservoir["k"]
+        seed = self.reservoir["seed"]
+        counts = self.reservoir["counts"]
+        if api not in self:
+            self[api] = []
+            counts[api] = 0
+        sample = self[api]
+        n = counts[api]
+        for r in realizations:
+            n += 1
+            if len(sample) < k:
+                sample.append(r)
+                continue
+            j = reservoir_slot(seed, api, n)
+            if j < k:
+                sample[j] = r
+        counts[api] = n
+
+    ## Same as merge_api_traces
+    def merge_api_traces(self, dicts):
+        for trace in dicts:
+            for api, entries in trace.items():
+                self.add(api, entries)
+        return self
+
+    def close(self):
+        return dict(self), self.reservoir
+
+## Reduce step of the parallel ingest, like merge_kb_shards
+def merge_sampled_kb_shards(kb, shard):
+    kb[0].merge_api_traces([shard[0]])
+    merge_syscalls(kb[1], shard[1])
+    merge_shard_extras(kb, shard)
+    return kb
@@ -0,0 +1,126 @@
+import sys
+import re
+import pickle
+import heapq
+import tempfile
+
+unfinished_syscall_re = re.compile(r"(.*) [<]?unfinished \.\.\.>.*$")
+resumed_syscall_re = re.compile(r"^.*<\.\.\. ([\S]+) resumed>(.*)$")
+
+## Number of straightened lines kept in memory before a sorted run is
+## spilled to a temporary file
+RUN_SIZE = 500000
+## Number of lines pickled together when spilling a run
+RUN_CHUNK = 4096
+
+def resume_syscall(beginning, ending):
+    match = resumed_syscall_re.match(ending)
+    if match is None: # the second one is not a resumed syscall
+        return None
+    (resumed_name, ends) = match.groups()
+
+    match = unfinished_syscall_re.match(beginning)
+    if match is None: # the first one is not an unfinished syscall
+        return None
+    unfinished = match.group(1)
+    if resumed_name not in unfinished: # the syscall name don't match
+        return None
+    return unfinished + ends + "\n"
+
+def is_unfinished(line):
+    return unfinished_syscall_re.match(line)
+
+def is_resumed(line):
+    return resumed_syscall_re.match(line)
+
+## Merge the <unfinished ...> and <... resumed> lines of a pid, given in
+## lexicographic order. pending maps each pid to its unfinished line.
+## Yields (trigger, line) pairs, where trigger is the input line that caused
+## line to be emitted.
+def resume_lines(pending, pid, lines):
+    for line, cnt in lines:
+        if pid not in pending:
+            if is_unfinished(line):
+                pending[pid] = line
+            elif is_resumed(line):
+                print("%d: %s -> resumed syscall but no pending one" %
+                      (cnt, line),
+                      file = sys.stderr)
+            else:
+                yield (line, line)
+        else:
+            if is_resumed(line) and is_unfinished(line):
+                continue
+            elif is_resumed(line):
+                complete = resume_syscall(pending.pop(pid), line)
+                if complete == None:
+                    continue
+                yield (line, complete)
+            elif is_unfinished(line):
+                print(("%d: unfinished syscall but there's a" +
+                       " pending one\npending:%sfound:%s\n")
+                      % (cnt, pending[pid], line), file = sys.stderr)
+            else:
+                if "killed" in line:
+                    yield (line, pending[pid])
+                    yield (line, line)
+                else:
+                    print(("%d: syscall pending but the next one is " +
+                           "not completing it.\npending: %sfound: %s") %
+                          (cnt, pending[pid], line),
+                          file = sys.stderr)
+
+## Stream the strace output keeping, for each pid, only its pending
+## unfinished line and the lines sharing its last timestamp.
+## The old implementation sorted the whole file to group lines by pid, so
+## lines of a pid with the same timestamp are processed in lexicographic
+## order, and sorting the emitted lines by trigger reproduces its output.
+## This assumes that the lines of a pid are written in timestamp order,
+## which is the case for strace -ttt output.
+def straighten(lines):
+    pending = {}
+    batches = {}
+
+    for cnt, line in enumerate(lines):
+        pid = line.split(' ', 1)[0]
+        stamp = line.split(None, 2)[1:2]
+        batch = batches.get(pid)
+        if batch is not None:
+            if batch[0] == stamp:
+                batch[1].append((line, cnt))
+                continue
+            yield from resume_lines(pending, pid, sorted(batch[1]))
+        batches[pid] = (stamp, [(line, cnt)])
+
+    for pid, (_, batch) in batches.items():
+        yield from resume_lines(pending, pid, sorted(batch))
+
+def spill_run(run):
+    run.sort()
+    f = tempfile.TemporaryFile()
+    for i in range(0, len(run), RUN_CHUNK):
+        pickle.dump(run[i:i+RUN_CHUNK], f, pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+def read_run(f):
+    try:
+        while True:
+            yield from pickle.load(f)
+    except EOFError:
+        f.close()
+
+## Sort the straightened lines by timestamp using sorted runs of at most
+## run_size lines and a k-way merge of the runs
+def sort_by_timestamp(entries, run_size=RUN_SIZE):
+    runs = []
+    run = []
+    for seq, (trigger, line) in enumerate(entries):
+        run.append((float(line.split()[1]), trigger, seq, line))
+        if len(run) >= run_size:
+            runs.append(spill_run(run))
+            run = []
+    run.sort()
+
+    for entry in heapq.merge(*[read_run(f) for f in runs], run):
+        yield entry[-1]
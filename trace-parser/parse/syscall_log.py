@@ -0,0 +1,54 @@
+import sys
+import heapq
+from syscall2api.tokenizer import tokenize_strace_line
+from .straighten import spill_run, read_run, RUN_SIZE
+
+def parse_datetime_syscalls(s):
+    return float(s)
+
+## Parse a straightened strace line into a full log event:
+## (timestamp, "JAVA", tid, S/E, api) or (timestamp, "SYSCALL", tid, syscall, "")
+def parse_syscall_line(line):
+    tokens = tokenize_strace_line(line)
+    if tokens is None:
+        return None
+    (date_time, type, tid, state, payload) = tokens
+    date_time = parse_datetime_syscalls(date_time)
+    if type == "API":
+        return (date_time, "JAVA", tid, state, payload)
+    return (date_time, "SYSCALL", tid, payload, "")
+
+def full_log_line(event):
+    return '%f %s' % (event[0], ' '.join(event[1:]))
+
+## Merge the sorted runs of each thread. list.sort is linear on runs that
+## are already sorted, which is the common case for the events of a thread
+def merge_thread_runs(threads):
+    for run in threads.values():
+        run.sort()
+    return heapq.merge(*threads.values())
+
+## Events of a straightened strace file, parsed with parse_syscall_line,
+## in sorted order. Events are split in per-tid runs; once run_size
+## events are buffered the runs are merged into a single sorted run on
+## disk, and the runs are merged lazily at the end
+def sorted_syscalls(f, run_size=RUN_SIZE):
+    spilled = []
+    threads = {}
+    buffered = 0
+    for line in f:
+        parsed = parse_syscall_line(line)
+        if not parsed:
+            print("Syscall line ignored: %s" % line, file=sys.stderr)
+            continue
+        if parsed[2] not in threads:
+            threads[parsed[2]] = []
+        threads[parsed[2]].append(parsed)
+        buffered += 1
+        if buffered >= run_size:
+            spilled.append(spill_run(list(merge_thread_runs(threads))))
+            threads = {}
+            buffered = 0
+
+    return heapq.merge(*[read_run(run) for run in spilled],
+                       merge_thread_runs(threads))
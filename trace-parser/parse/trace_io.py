@@ -0,0 +1,22 @@
+import os.path
+import gzip
+import lzma
+import bz2
+
+## Trace files (_strace, _strace_full, _binder_parsed, ...) may be
+## compressed. They are decompressed while they are read, line by line.
+compressed_openers = {".gz": gzip.open, ".xz": lzma.open, ".bz2": bz2.open}
+
+def open_trace(path, mode="r"):
+    opener = compressed_openers.get(os.path.splitext(path)[1])
+    if opener is None:
+        return open(path, mode)
+    return opener(path, mode + "t" if "b" not in mode else mode)
+
+## path itself if it exists, otherwise its first compressed variant that
+## does, or None
+def find_trace(path):
+    for candidate in [path] + [path + ext for ext in compressed_openers]:
+        if os.path.exists(candidate):
+            return candidate
+    return None
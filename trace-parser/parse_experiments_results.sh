@@ -11,22 +11,8 @@ fi
 
 DIR=$1
 CWD=$(pwd)
-RESULT_FILES=$(find $DIR -not -empty -regex ".*_strace")
-
-for FILE in $RESULT_FILES
-do
-    echo "Preporcessing syscall file$FILE"
-    STRAIGHTENED_FILE=$FILE"_straight"
-    if [ ! -f $STRAIGHTENED_FILE ]; then
-	python3 straighten_strace.py $FILE > $STRAIGHTENED_FILE 2>/dev/null
-    fi
-
-    FULL_LOG=$FILE"_full"
-    if [ ! -f $FULL_LOG ]; then
-	python3 parse_complete_syscall_log.py $STRAIGHTENED_FILE\
-		> $FULL_LOG 2>/dev/null
-    fi
-done;
+## Raw strace files may be compressed (.gz, .xz or .bz2)
+STRACE_FILES=($(find $DIR -not -empty -regex ".*_strace\(\.gz\|\.xz\|\.bz2\)?"))
 
 BINDER_FILES=$(find $DIR -not -empty -regex ".*_binder")
 for FILE in $BINDER_FILES
@@ -39,5 +25,5 @@ do
 done;
 
 
-FULL_LOGS=($(find $DIR -not -empty -regex ".*_full"))
-python3 read_full_log.py $TREE ${FULL_LOGS[@]} 2>/dev/null
+## Straighten, parse and load the raw strace files in a single pass
+python3 read_full_log.py --raw $TREE ${STRACE_FILES[@]} 2>/dev/null
@@ -6,67 +6,101 @@ import os.path
 import argparse
 import re
 import pickle
+import bisect
 from collections import defaultdict
+from functools import reduce
+from multiprocessing import Pool
 from subprocess import Popen, PIPE
 from parse import *
 
-def compute_trace_no_tree(trace, tid):
+## Size of the START and NOAPI realizations of a thread
+def count_unattributed_syscalls(stats, tid, ret):
+    for (api, key) in (("START", "start_size"), ("NOAPI", "noapi_size")):
+        size = sum(len(x) for x in ret.get(api, []))
+        if size != 0:
+            count_ingest(stats, key, tid, n=size)
+
+## Every syscall belongs to all the frames on the stack, so the syscalls of
+## the thread are stored once and each frame is the index of the first
+## syscall issued after it was pushed. Realizations are recorded as
+## [start, end) spans of the syscalls while the thread is walked, and
+## sliced out once it ends.
+## The slices are copies on purpose: the KB stores each realization as its
+## own list (and pickles it as one), so a realization has to become a list
+## when it is merged into the KB anyway, and views of the thread's syscalls
+## would only move the copy to merge_api_traces. A slice only holds
+## references to the shared syscall tuples, so the copies take one pointer
+## per syscall per enclosing API, which is the size of the realizations in
+## the KB.
+def compute_trace_no_tree(trace, tid, stats=None):
+    if stats is None:
+        stats = new_ingest_stats()
     print(("Processing trace for tid %s. " % tid) +
           ("Input lenght: %d" % len(trace)), file=sys.stderr)
     ret = {}
     stack = []
-    calls = []
+    syscalls = []
     current_api = "START"
-    stack.append((current_api, calls))
+    stack.append((current_api, 0))
     ## entry = (type, state (None for syscalls), API/SYSCALL name)
     for cnt, (type, state, name, timestamp) in enumerate(trace):
-        current_api = stack[-1][0]
-        calls = stack[-1][1]
+        (current_api, start) = stack[-1]
         if type == "SYS":
-            for (a, c) in stack:
-                c.append(("SYS", name))
+            syscalls.append(("SYS", name))
         elif type == "API" and state == "S":
             if current_api == 'START':
-                ret['START'] = [calls]
+                ret['START'] = [(start, len(syscalls))]
                 stack.pop()
             elif current_api == "NOAPI":
                 if "NOAPI" not in ret:
                     ret["NOAPI"] = []
-                if len(calls) != 0:
-                    ret["NOAPI"].append(calls)
+                if len(syscalls) != start:
+                    ret["NOAPI"].append((start, len(syscalls)))
                 stack.pop()
-            stack.append((name, list()))
+            stack.append((name, len(syscalls)))
         elif type == "API" and state == "E":
             ## easy case: no need to unwind
             if name == current_api:
                 stack.pop()
                 if len(stack) == 0:
-                    stack.append(("NOAPI", list()))
+                    stack.append(("NOAPI", len(syscalls)))
                 if name not in ret:
                     ret[name] = list()
-                ret[name].append(calls)
+                ret[name].append((start, len(syscalls)))
             elif name in ("START", "NOAPI"):
                 continue
             else: ## unwind
                 while name != current_api:
                     stack.pop()
+                    ingest_event(stats, "unwinds", tid, current_api,
+                                 "end of API %s not found at line %d",
+                                 current_api, cnt)
                     if current_api not in ret:
                         ret[current_api] = list()
-                    ret[current_api].append(calls)
+                    ret[current_api].append((start, len(syscalls)))
                     if len(stack) == 0:
-                        stack.append(("NOAPI", list()))
-                        print("Stack totally unwinded", file=sys.stderr)
+                        stack.append(("NOAPI", len(syscalls)))
+                        count_ingest(stats, "stack_unwound", tid)
+                        ingest_event(stats, "orphan_ends", tid, name,
+                                     "start of %s not found, timestamp %s",
+                                     name, timestamp)
                         break
-                    (current_api, calls) = stack[-1]
+                    (current_api, start) = stack[-1]
+
+    for api, spans in ret.items():
+        ret[api] = [syscalls[start:end] for (start, end) in spans]
 
     print("Processing output stats. Different APIS: %d" % len(ret),
           file=sys.stderr)
     if None in ret:
         del ret[None]
+    count_unattributed_syscalls(stats, tid, ret)
 
     return ret
 
-def compute_trace(trace, tid):
+def compute_trace(trace, tid, stats=None):
+    if stats is None:
+        stats = new_ingest_stats()
     print(("Processing trace for tid %s. " % tid) +
           ("Input lenght: %d" % len(trace)), file=sys.stderr)
     ret = {}
@@ -110,28 +144,20 @@ def compute_trace(trace, tid):
         elif type == "API" and state == "E":
             if name != current_api:
                 while True:
-                    print("=================================", file=sys.stderr)
-                    print("Warning: end of API %s not found.\n" % current_api +
-                          "TID: %s Line: %d Timestamp:%s\n" %
-                          (tid, cnt, timestamp) +
-                          "APIs already parsed: %d" % len(ret),
-                          file=sys.stderr)
-                    print("=================================", file=sys.stderr)
+                    ingest_event(stats, "unwinds", tid, current_api,
+                                 "end of API %s not found at line %d, " +
+                                 "timestamp %s", current_api, cnt, timestamp)
 
                     if current_api not in ret:
                         ret[current_api] = []
                     ret[current_api].append(calls)
 
                     if len(stack) == 0:
-                        print("=================================",
-                              file=sys.stderr)
-                        print(("TID: %s: while unwinding " +
-                               "the stack, the starting point " +
-                               "of %s was not found. Timestamp: %s. " +
-                               "Is this the main thread?")
-                              % (tid, name, timestamp), file=sys.stderr)
-                        print("=================================",
-                              file=sys.stderr)
+                        count_ingest(stats, "stack_unwound", tid)
+                        ingest_event(stats, "orphan_ends", tid, name,
+                                     "start of %s not found while " +
+                                     "unwinding, timestamp %s",
+                                     name, timestamp)
                         stack.append(("NOAPI", []))
                         break
 
@@ -150,24 +176,20 @@ def compute_trace(trace, tid):
           file=sys.stderr)
     if None in ret:
         del ret[None]
+    count_unattributed_syscalls(stats, tid, ret)
 
     return ret
 
-def update_syscalls(syscalls, traces):
-    for api in traces:
-        for trace in traces[api]:
-            if len(trace) == 0:
-                continue
-            syscalls_l = [x for (t, x) in trace if 'SYS' in t]
-            for syscall in syscalls_l:
-                syscall_name = syscall.split('(')[0]
-                if syscall_name not in syscalls:
-                    continue
-                if api not in syscalls[syscall_name]:
-                    syscalls[syscall_name].append(api)
-            
+## The syscall index, if given, is updated with the occurrences of each
+## syscall in the realizations of each API
+def update_syscalls(syscalls, traces, index=None):
+    if index is None:
+        index = {}
+    update_syscall_index(index, syscalls, traces)
 
 def merge_api_traces(db, dicts):
+    if isinstance(db, (KBPartitions, SampledKB)):
+        return db.merge_api_traces(dicts)
     for trace in dicts:
         for api in trace.keys():
             if api not in db:
@@ -176,97 +198,289 @@ def merge_api_traces(db, dicts):
                 db[api].append(entry)
     return db
 
+## Replace, in each thread, the BINDER_WRITE_READ ioctl preceding a binder
+## service event with the service. Binder events and syscalls are walked
+## together in timestamp order: the ioctls found so far that haven't been
+## replaced yet are kept on a stack and each service event takes the most
+## recent one.
 def replace_ioctls(app, threads_syscalls):
-    with open(app + "_binder_parsed", "r") as f:
-        lines = f.readlines()
+    binder_file = find_trace(app + "_binder_parsed")
+    if binder_file is None:
+        binder_file = app + "_binder_parsed"
 
     threads_binder = defaultdict(list)
-    for line in lines:
-        tmp = parse_line(line)
-        if tmp[0] is not None:
-            threads_binder[tmp[0]].append(tmp)
+    with open_trace(binder_file) as f:
+        for line in f:
+            tmp = parse_line(line)
+            if tmp[0] is not None:
+                threads_binder[tmp[0]].append(tmp)
 
     for thr, servs in threads_binder.items():
-        if thr == "7492":
-            with open("s_7518", "w") as fff:
-                fff.write("\n".join([str(x) for x in threads_syscalls[thr]]))
-        for serv in servs:
-            (_, _, _, service, btime) = serv
-            if thr not in threads_syscalls:
-                continue
-            sys_trace = list(threads_syscalls[thr])
-            last_ioctl = -1
-            for (index, (stype, _, spayload, stime)) in enumerate(sys_trace):
-                if float(stime) > float(btime):
-                    ## replace ioctl with service here
-                    if last_ioctl != -1:
-                        print("Yeah!", file=sys.stderr)
-                        threads_syscalls[thr][last_ioctl] = serv[1:]
-                    else:
-                        print("TID: %s, BTimestamp: %s, STimestamp: %s, IOCTL for service %s not found" % (thr, btime, stime, service), file=sys.stderr)
-                    break
-                if stype != "SYS":
-                    continue
-                if binder_ioctl_re.match(spayload):
-                    print("updated")
-                    last_ioctl = index
-        if thr == "7492":
-            with open("e_7518", "w") as fff:
-                fff.write("\n".join([str(x) for x in threads_syscalls[thr]]))
-
-
-def main(db, syscalls, app_name, log_file, tree=True, services=False):
+        if thr not in threads_syscalls:
+            continue
+        sys_trace = threads_syscalls[thr]
+        ## A service event goes before the first syscall with a greater
+        ## timestamp, so the running maximum is used as the sort key
+        max_times = []
+        max_time = float("-inf")
+        for (_, _, _, stime) in sys_trace:
+            max_time = max(max_time, float(stime))
+            max_times.append(max_time)
+
+        ioctls = []
+        index = 0
+        for (btime, serv) in sorted(((float(serv[4]), serv) for serv in servs),
+                                    key=lambda x: x[0]):
+            end = bisect.bisect_right(max_times, btime)
+            if end == len(sys_trace):
+                ## No syscall after the service event
+                break
+            while index < end:
+                (stype, _, spayload, _) = sys_trace[index]
+                if stype == "SYS" and binder_ioctl_re.match(spayload):
+                    ioctls.append(index)
+                index += 1
+            if len(ioctls) != 0:
+                sys_trace[ioctls.pop()] = serv[1:]
+            else:
+                print("TID: %s, BTimestamp: %s, STimestamp: %s, IOCTL for service %s not found" % (thr, serv[4], sys_trace[end][3], serv[3]), file=sys.stderr)
+
+
+def read_threads_traces(log_file):
     print("Reading input file", file=sys.stderr)
-    lines = log_file.readlines()
-    log_file.close()
     threads_traces = {}
-    api_syscalls_matches = []
-    ct = compute_trace if tree else compute_trace_no_tree
-    print("Passing over input file", file=sys.stderr)
-    for line in lines:
+    for line in log_file:
         (tid, type, state, payload, timestamp) = parse_line(line)
         if tid is None:
             continue
         if tid not in threads_traces:
             threads_traces[tid] = []
         threads_traces[tid].append((type, state, payload, timestamp))
+    log_file.close()
+    return threads_traces
+
+def build_kb(db, syscalls, app_name, threads_traces, tree=True,
+             services=False, index=None, stats=None):
+    api_syscalls_matches = []
+    ct = compute_trace if tree else compute_trace_no_tree
+    if stats is None:
+        stats = new_ingest_stats()
+    set_ingest_app(stats, app_name)
 
     if services:
         replace_ioctls(app_name, threads_traces)
 
     for tid, trace in threads_traces.items():
-        trace = ct(trace, tid)
+        trace = ct(trace, tid, stats)
         api_syscalls_matches.append(trace)
-        update_syscalls(syscalls, trace)
+        update_syscalls(syscalls, trace, index)
 
     print("Cleaning up traces", file=sys.stderr)
     merge_api_traces(db, api_syscalls_matches)
 
+def main(db, syscalls, app_name, log_file, tree=True, services=False,
+         index=None, stats=None):
+    threads_traces = read_threads_traces(log_file)
+    build_kb(db, syscalls, app_name, threads_traces, tree, services, index,
+             stats)
+
+## Fused ingest of a raw _strace file, without the _straight and _full files
+def main_raw(db, syscalls, app_name, strace_file, tree=True, services=False,
+             index=None, stats=None):
+    print("Reading raw strace file", file=sys.stderr)
+    threads_traces = read_strace_threads(strace_file)
+    build_kb(db, syscalls, app_name, threads_traces, tree, services, index,
+             stats)
+
+def ingest_trace(db, syscalls, trace, tree=True, services=False, raw=False,
+                 index=None, stats=None):
+    print("Processing " + trace)
+    if raw:
+        app_name = trace.split("_strace")[0]
+        main_raw(db, syscalls, app_name, open_trace(trace), tree, services,
+                 index, stats)
+    else:
+        app_name = trace.split("_strace_full")[0]
+        main(db,syscalls, app_name, open_trace(trace), tree, services, index,
+             stats)
+
+## Map step of the parallel ingest: build the partial KB of a single file
+def build_kb_shard(trace, syscall_names, tree=True, services=False,
+                   raw=False, sample=0):
+    db = {}
+    syscalls = {x: list() for x in syscall_names}
+    index = {}
+    stats = new_ingest_stats(sample)
+    ingest_trace(db, syscalls, trace, tree, services, raw, index, stats)
+    return (db, syscalls, index, stats)
+
+def build_kb_shard_star(args):
+    return build_kb_shard(*args)
+
+def build_kb_parallel(db, syscalls, index, stats, traces, jobs, tree=True,
+                      services=False, raw=False, merge=merge_kb_shards):
+    args = [(trace, list(syscalls.keys()), tree, services, raw,
+             stats["sample"])
+            for trace in traces]
+    with Pool(jobs) as pool:
+        ## imap keeps the input order, so shards are reduced in order
+        shards = pool.imap(build_kb_shard_star, args)
+        return reduce(merge, shards, (db, syscalls, index, stats))
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument("traces", type=str, nargs="+")
     parser.add_argument("--no-tree", action="store_true")
     parser.add_argument("--services", action="store_true")
+    parser.add_argument("--raw", action="store_true",
+                        help="traces are raw _strace files")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of worker processes")
+    parser.add_argument("--store", type=str, default=None,
+                        help="append a shard to this KB store instead of " +
+                        "rewriting db.pickle")
+    parser.add_argument("--partitions", type=str, default=None,
+                        help="append the realizations to the partitions " +
+                        "in this directory instead of keeping the KB in " +
+                        "memory")
+    parser.add_argument("--num-partitions", type=int, default=64,
+                        help="number of partitions of a new partition " +
+                        "directory")
+    parser.add_argument("--buffer-events", type=int, default=BUFFER_EVENTS,
+                        help="events buffered in memory before they are " +
+                        "written to the partitions")
+    parser.add_argument("--reservoir", type=int, default=None,
+                        help="keep a uniform sample of at most this many " +
+                        "realizations per API, and their exact counts")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of the --reservoir sampling (default 0)")
+    parser.add_argument("--interned", action="store_true",
+                        help="store the KB with interned API and syscall " +
+                        "names")
+    parser.add_argument("--stats", type=str, default="ingest_stats.json",
+                        help="JSON summary of the ingest diagnostics")
+    parser.add_argument("--verbose-log", type=str, default=None,
+                        help="write a sample of the ingest diagnostics here")
+    parser.add_argument("--log-sample", type=int, default=100,
+                        help="log one diagnostic event out of this many")
     return parser.parse_args()
 
+## Drop the traces already ingested in the store, or given twice.
+## Returns a {hash: trace} dictionary
+def new_traces(store, traces):
+    ingested = load_manifest(store)["ingested"]
+    ret = {}
+    for trace in traces:
+        h = trace_hash(trace)
+        if h in ingested or h in ret:
+            print("%s already ingested" % trace)
+            continue
+        ret[h] = trace
+    return ret
+
 if __name__ == "__main__":
     args = parse_arguments()
     tree = not args.no_tree
     traces = args.traces
     services = args.services
 
-    db, syscalls = load_db()
-    if len(syscalls) == 0:
-        syscalls_list = read_syscall_list()
-        syscalls = {x: list() for x in syscalls_list}
-
     for arg in traces:
-        print("Processing " + arg)
         if not os.path.exists(arg):
             print("%s: file doesn't exist" % arg)
             sys.exit(1)
-        app_name = arg.split("_strace_full")[0]
-        main(db,syscalls, app_name, open(arg, "r"), tree, services)
 
-    store_db(db, syscalls)
+    if args.partitions is not None and (args.store or args.interned):
+        print("--partitions can't be used with --store or --interned")
+        sys.exit(1)
+    ## A sampled KB stays sampled, with the same k and seed
+    reservoir = None
+    if args.store is None and args.partitions is None:
+        reservoir = load_reservoir(kb_file=db_filename)
+    if reservoir is not None and \
+       ((args.reservoir is not None and args.reservoir != reservoir["k"]) or
+        (args.seed is not None and args.seed != reservoir["seed"])):
+        print("%s was sampled with --reservoir %d --seed %d" %
+              (db_filename, reservoir["k"], reservoir["seed"]))
+        sys.exit(1)
+    if reservoir is None and args.reservoir is not None:
+        reservoir = new_reservoir(args.reservoir,
+                                  args.seed if args.seed is not None else 0)
+    if reservoir is not None and (args.store or args.partitions):
+        print("--reservoir can't be used with --store or --partitions")
+        sys.exit(1)
+
+    if args.store is not None:
+        to_ingest = new_traces(args.store, traces)
+        if len(to_ingest) == 0:
+            sys.exit(0)
+        traces = list(to_ingest.values())
+        db = dict()
+        syscalls = dict()
+    elif args.partitions is not None:
+        db = KBPartitions(args.partitions, args.num_partitions,
+                          args.buffer_events)
+        syscalls, index = load_partition_syscalls(args.partitions)
+    else:
+        db, syscalls = load_db()
+
+    if len(syscalls) == 0:
+        syscalls_list = read_syscall_list()
+        syscalls = {x: list() for x in syscalls_list}
+
+    if args.store is not None:
+        index = {}
+    elif args.partitions is None:
+        index = load_syscall_index(kb_file=db_filename)
+    if index is None and args.partitions is not None:
+        index = build_partitions_syscall_index(args.partitions,
+                                               syscalls.keys())
+    elif index is None:
+        index = build_syscall_index(db, syscalls.keys())
+    stats = new_ingest_stats(args.log_sample if args.verbose_log else 0)
+
+    ## An interned KB stays interned
+    interned = args.interned or \
+        (args.partitions is None and is_interned_kb(db))
+    if interned and reservoir is not None:
+        print("--reservoir can't be used with an interned KB")
+        sys.exit(1)
+    if interned and not is_interned_kb(db):
+        db = intern_kb(db)
+    merge = merge_interned_kb_shards if interned else merge_kb_shards
+    if args.partitions is not None:
+        merge = merge_partitioned_kb_shards
+    if reservoir is not None:
+        db = SampledKB(db, reservoir)
+        merge = merge_sampled_kb_shards
+
+    if args.jobs > 1:
+        (db, syscalls, index, stats) = build_kb_parallel(db, syscalls, index,
+                                                         stats, traces,
+                                                         args.jobs, tree,
+                                                         services, args.raw,
+                                                         merge)
+    elif interned:
+        ## Intern the KB of each file as soon as it is built
+        shards = (build_kb_shard(arg, list(syscalls.keys()), tree, services,
+                                 args.raw, stats["sample"])
+                  for arg in traces)
+        (db, syscalls, index, stats) = reduce(merge, shards,
+                                              (db, syscalls, index, stats))
+    else:
+        for arg in traces:
+            ingest_trace(db, syscalls, arg, tree, services, args.raw, index,
+                         stats)
+
+    if args.store is not None:
+        append_shard(args.store, db, syscalls, to_ingest, index)
+    elif args.partitions is not None:
+        db.close(syscalls, index)
+        finalize_partitions(args.partitions, args.jobs)
+    else:
+        if reservoir is not None:
+            (db, reservoir) = db.close()
+        store_db(db, syscalls)
+        if reservoir is not None:
+            store_reservoir(reservoir, kb_file=db_filename)
+        store_syscall_index(index, kb_file=db_filename)
+    store_ingest_stats(stats, args.stats, args.verbose_log)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import random
+import argparse
+
+from syscall2api.tokenizer import *
+from parse.syscall_log import parse_syscall_line, full_log_line
+
+apis = ["android.os.Parcel.readString()",
+        "android.os.Parcel.writeInterfaceToken(java.lang.String)",
+        "android.app.ContextImpl.getSystemService(java.lang.String)",
+        "java.io.File.exists()"]
+syscalls = ['openat(AT_FDCWD, "/data/data/app/shared_prefs/prefs.xml", ' +
+            'O_RDONLY|O_LARGEFILE) = 42',
+            'read(42, "<?xml version=\'1.0\' encoding=\'utf-8\' standalone=' +
+            '\'yes\' ?>\\n<map>\\n", 4096) = 58',
+            'ioctl(7</dev/binder>, BINDER_WRITE_READ, 0x7ff4e1c3d8) = 0',
+            'futex(0x7f9c0b0e54, FUTEX_WAKE_PRIVATE, 1) = 0',
+            'mmap(NULL, 1040384, PROT_READ, MAP_PRIVATE|MAP_NORESERVE, ' +
+            '-1, 0) = 0x7f8e0c1000',
+            'close(42) = 0']
+
+## Synthetic straightened strace output with the given API/syscall ratio
+def synthetic_strace(n, api_ratio=0.3, seed=0):
+    rnd = random.Random(seed)
+    tids = [rnd.randint(1000, 30000) for _ in range(8)]
+    timestamp = 11144708.0
+    lines = []
+    for _ in range(n):
+        timestamp += rnd.random() / 1000
+        tid = rnd.choice(tids)
+        if rnd.random() < api_ratio:
+            payload = 'write(53</dev/null>, "%s %s", 32) = 32' % (
+                rnd.choice("SE"), rnd.choice(apis))
+        else:
+            payload = rnd.choice(syscalls)
+        lines.append("%-5d %.6f %s\n" % (tid, timestamp, payload))
+    return lines
+
+def lines_per_second(func, lines, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            func(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(lines) / best
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--api-ratio", type=float, default=0.3)
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    strace_lines = synthetic_strace(args.lines, args.api_ratio)
+    full_lines = [full_log_line(parse_syscall_line(l)) + "\n"
+                  for l in strace_lines]
+
+    benchmarks = [
+        ("strace lines, regexes", tokenize_strace_line_regex, strace_lines),
+        ("strace lines, tokenizer", tokenize_strace_line, strace_lines),
+        ("full log lines, regexes", tokenize_full_line_regex, full_lines),
+        ("full log lines, tokenizer", tokenize_full_line, full_lines),
+    ]
+    for (name, func, lines) in benchmarks:
+        print("%-28s %12.0f lines/s" %
+              (name, lines_per_second(func, lines, args.repeat)))